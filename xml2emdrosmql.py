@@ -14,19 +14,120 @@
 import sys
 import os
 import tempfile
+import getopt
 import xml.sax
 
 from xml2mql import xml2mql
+from xml2mql import emdros_sink
+from xml2mql import warm_worker
 
 def usage():
     sys.stderr.write("""
 Usage:
      python3 xml2mql.py command [options] jsonfilename.json [filename.xml...]
+     python3 xml2mql.py mql --plan plan.json --shard K jsonfilename.json
+     python3 xml2mql.py merge --plan plan.json shard.mql...
+     python3 xml2mql.py reemit [--first-monad N] [--first-id-d N] [--first-docindex N] objects.bin
+     python3 xml2mql.py worker [--socket PATH] jsonfilename.json
 
 COMMANDS
      json        Generate an example JSON script, put it into jsonfilename.json
      mql         Generate MQL based on jsonfilename.json
      renderjson  Generate RenderObjects JSON based on jsonfilename.json
+     plan        Count the monads, id_ds and docindexes each XML file will
+                 use, and write an import plan assigning them to shards
+                 (requires --plan; see also --shards)
+     count       Count the monads, id_ds, tokens and objects per object type
+                 that mql would produce, per file and in total, along with
+                 the approximate size of the MQL, without generating it
+     reemit      Write the MQL for objects saved with --save-objects,
+                 optionally moved to start at other monads, id_ds and
+                 docindexes
+     merge       Check that the MQL outputs of all the shards of a plan
+                 fit together, and write them to stdout in order
+     validate    Check the XML files against jsonfilename.json, without
+                 generating anything: report every unknown element, every
+                 attribute value which is not valid for its featureType,
+                 and every file which is not well-formed, with its line
+     worker      Read jsonfilename.json once, then generate MQL for the
+                 jobs read from stdin, one JSON object per line (see
+                 xml2mql/warm_worker.py), replying on stdout
+
+OPTIONS
+     --first-monad N         The first monad to use (default: 1, or the
+                             original one for reemit)
+     --first-id-d N          The first id_d to use (default: 1, or the
+                             original one for reemit)
+     --first-docindex N      The first docindex to use (reemit; default:
+                             the original one)
+     --save-objects FILE     Also save the objects to FILE in a compact
+                             binary format, for reemit (mql)
+     --catalog DIR           Read DTDs and external entities from the
+                             local catalog directory DIR (see
+                             xml2mql/entity_catalog.py), never from the
+                             network
+     --prefetch K            Read (and decompress) the next K XML files
+                             in the background while parsing (json, mql)
+     --prefetch-memory MB    Cap the memory used by blocks read but not
+                             yet parsed, of the current file and of
+                             those read ahead (default: 256 MB)
+     --writer MODE           Write finished documents in the background
+                             while parsing goes on (mql).  MODE is
+                             'thread' or 'process'
+     --writer-queue N        Let at most N finished documents wait for
+                             the background writer (default: 2)
+     --include-types A,B     Only write these object types (mql, count)
+     --exclude-types A,B     Do not write these object types (mql, count)
+     --include-features T.F,...
+                             Only write these features, given as
+                             objectTypeName.featureName (mql)
+     --exclude-features T.F,...
+                             Do not write these features (mql)
+                             Unwritten object types and features still
+                             use monads and IDs, so the output lines up
+                             with that of a full run.
+     --emdros-db DB          Load the MQL straight into the existing Emdros
+                             database DB through the Emdros Python
+                             bindings, instead of writing it (mql, reemit)
+     --emdros-backend B      sqlite3 (default), postgresql, mysql or bpt
+     --emdros-host HOST      Database host (default: localhost)
+     --emdros-user USER      Database user (default: emdf)
+     --emdros-password PW    Database password (default: empty)
+     --index FILE            Write a sidecar index to FILE, giving the
+                             monads, id_ds and docindexes of each
+                             document (see xml2mql/sidecar_index.py)
+                             (mql)
+     --index-types A,B       Also index the elements of these object
+                             types which have an xml:id (mql)
+     --profile FILE          Measure the time spent on each element,
+                             write a table of the most costly ones to
+                             stderr, and a JSON report to FILE (mql)
+     --split-element TAG     Split each XML file into chunks at the TAG
+                             elements which are not inside another TAG,
+                             and parse the chunks in several processes
+                             at once (mql; uncompressed files only)
+     --split-workers N       The number of processes (default: the
+                             number of CPUs)
+     --split-size MB         The approximate size of each chunk
+                             (default: 16 MB)
+     --also SCRIPT=FILE      Also write the MQL for the JSON script SCRIPT
+                             to FILE, from the same parse of the XML
+                             files (mql; may be given several times)
+     --skip-duplicates MODE  Skip XML files whose contents are the same as
+                             those of an earlier file (mql).  MODE is
+                             'raw' (byte-identical) or 'canonical'
+                             (identical apart from whitespace)
+     --duplicate-index FILE  Keep the hashes of imported files in FILE,
+                             so that later runs skip them as well (mql)
+     --workers N             The number of files to check at once
+                             (validate; default: the number of CPUs)
+     --socket PATH           Read worker jobs from connections to the Unix
+                             socket PATH instead of from stdin (worker)
+     --plan FILE             The import plan to write (plan) or to
+                             read (mql, merge)
+     --shards N              Split the plan into N shards (default: 1)
+     --shard K               Generate the MQL for shard K of the plan
+                             (mql; shards are numbered from 0)
 
 """)
 
@@ -35,30 +136,273 @@ COMMANDS
     
 
 if __name__ == '__main__':
-    if len(sys.argv) < 4:
+    if len(sys.argv) < 3:
         usage()
         sys.exit(1)
     else:
         command = sys.argv[1]
         
-        if command in ["json", "mql", "renderjson"]:
+        if command in ["json", "mql", "renderjson", "plan", "count", "reemit", "merge", "worker", "validate"]:
             pass
         else:
             usage()
             sys.exit(1)
+
+        try:
+            (opts, args) = getopt.getopt(sys.argv[2:], "", ["prefetch=", "prefetch-memory=", "writer=", "writer-queue=", "plan=", "shards=", "shard=", "include-types=", "exclude-types=", "include-features=", "exclude-features=", "first-monad=", "first-id-d=", "first-docindex=", "save-objects=", "catalog=", "emdros-db=", "emdros-backend=", "emdros-host=", "emdros-user=", "emdros-password=", "socket=", "skip-duplicates=", "duplicate-index=", "also=", "split-element=", "split-workers=", "split-size=", "index=", "index-types=", "profile=", "workers="])
+        except getopt.GetoptError as e:
+            sys.stderr.write("ERROR: %s\n" % e)
+            usage()
+            sys.exit(1)
+
+        read_ahead = 0
+        max_prefetch_bytes = 256 * 1024 * 1024
+        writer_mode = None
+        max_documents_in_flight = 2
+        plan_filename = None
+        shard_count = 1
+        shard_index = None
+        selection = {}
+        first_monad = None
+        first_id_d = None
+        first_docindex = None
+        object_stream_filename = None
+        catalog_directory = None
+        emdros_database = None
+        emdros_backend_name = "sqlite3"
+        emdros_hostname = "localhost"
+        emdros_user = "emdf"
+        emdros_password = ""
+        socket_path = None
+        dedup_mode = None
+        dedup_index_filename = None
+        also_list = [] # (json_filename, mql_filename) pairs
+        split_element = None
+        index_filename = None
+        index_object_types = []
+        profile_filename = None
+        validate_worker_count = None
+        split_worker_count = None
+        split_chunk_bytes = 16 * 1024 * 1024
+        for (opt, value) in opts:
+            if opt == "--prefetch":
+                read_ahead = int(value)
+            elif opt == "--prefetch-memory":
+                max_prefetch_bytes = int(value) * 1024 * 1024
+            elif opt == "--writer":
+                if value not in ["thread", "process"]:
+                    usage()
+                    sys.exit(1)
+                writer_mode = value
+            elif opt == "--writer-queue":
+                max_documents_in_flight = int(value)
+            elif opt == "--plan":
+                plan_filename = value
+            elif opt == "--shards":
+                shard_count = int(value)
+            elif opt == "--shard":
+                shard_index = int(value)
+            elif opt == "--first-monad":
+                first_monad = int(value)
+            elif opt == "--first-id-d":
+                first_id_d = int(value)
+            elif opt == "--first-docindex":
+                first_docindex = int(value)
+            elif opt == "--save-objects":
+                object_stream_filename = value
+            elif opt == "--catalog":
+                catalog_directory = value
+            elif opt == "--emdros-db":
+                emdros_database = value
+            elif opt == "--emdros-backend":
+                if value not in emdros_sink.backend_names:
+                    usage()
+                    sys.exit(1)
+                emdros_backend_name = value
+            elif opt == "--emdros-host":
+                emdros_hostname = value
+            elif opt == "--emdros-user":
+                emdros_user = value
+            elif opt == "--emdros-password":
+                emdros_password = value
+            elif opt == "--socket":
+                socket_path = value
+            elif opt == "--skip-duplicates":
+                if value not in ["raw", "canonical"]:
+                    usage()
+                    sys.exit(1)
+                dedup_mode = value
+            elif opt == "--duplicate-index":
+                dedup_index_filename = value
+            elif opt == "--index":
+                index_filename = value
+            elif opt == "--index-types":
+                index_object_types.extend(value.split(","))
+            elif opt == "--profile":
+                profile_filename = value
+            elif opt == "--workers":
+                validate_worker_count = int(value)
+            elif opt == "--split-element":
+                split_element = value
+            elif opt == "--split-workers":
+                split_worker_count = int(value)
+            elif opt == "--split-size":
+                split_chunk_bytes = int(float(value) * 1024 * 1024)
+            elif opt == "--also":
+                (also_json_filename, equals, also_mql_filename) = value.partition("=")
+                if equals == "" or also_json_filename == "" or also_mql_filename == "":
+                    usage()
+                    sys.exit(1)
+                also_list.append((also_json_filename, also_mql_filename))
+            elif opt == "--include-types":
+                selection.setdefault("includedObjectTypeNameList", []).extend(value.split(","))
+            elif opt == "--exclude-types":
+                selection.setdefault("excludedObjectTypeNameList", []).extend(value.split(","))
+            elif opt == "--include-features":
+                selection.setdefault("includedFeatureNameList", []).extend(value.split(","))
+            elif opt == "--exclude-features":
+                selection.setdefault("excludedFeatureNameList", []).extend(value.split(","))
+
+        if command in ["plan", "merge"] and plan_filename == None:
+            usage()
+            sys.exit(1)
+
+        if first_docindex != None and command != "reemit":
+            sys.stderr.write("ERROR: --first-docindex can only be used with reemit.\n")
+            sys.exit(1)
+
+        if emdros_database != None and command not in ["mql", "reemit"]:
+            sys.stderr.write("ERROR: --emdros-db can only be used with mql and reemit.\n")
+            sys.exit(1)
+
+        if command == "merge":
+            if len(args) < 1:
+                usage()
+                sys.exit(1)
+            xml2mql.mergeShards(plan_filename, args, sys.stdout.buffer)
+            sys.exit(0)
+
+        if command == "worker":
+            if len(args) != 1:
+                usage()
+                sys.exit(1)
+            if first_monad == None:
+                first_monad = 1
+            if first_id_d == None:
+                first_id_d = 1
+            json_file = open(args[0], "rb")
+            worker = warm_worker.WarmWorker(json_file, first_monad, first_id_d, selection, catalog_directory)
+            json_file.close()
+            if socket_path != None:
+                worker.serveSocket(socket_path)
+            else:
+                worker.serveLines(sys.stdin, sys.stdout)
+            sys.exit(0)
+
+        if command == "validate":
+            if len(args) < 2:
+                usage()
+                sys.exit(1)
+            problem_count = xml2mql.validateXML(args[0], args[1:], sys.stdout, validate_worker_count, catalog_directory)
+            if problem_count > 0:
+                sys.exit(1)
+            sys.exit(0)
+
+        if emdros_database != None:
+            env = emdros_sink.openEmdrosEnv(emdros_database, emdros_backend_name, emdros_hostname, emdros_user, emdros_password)
+            mql_file = emdros_sink.EmdrosSink(env)
+        else:
+            mql_file = None
+
+        if command == "reemit":
+            if len(args) != 1:
+                usage()
+                sys.exit(1)
+            xml2mql.reemitMQL(args[0], first_monad, first_id_d, mql_file, first_docindex)
+            if mql_file != None:
+                mql_file.close()
+                sys.stderr.write("Executed %d statements in Emdros database %s.\n" % (mql_file.statement_count, emdros_database))
+            sys.exit(0)
+
+        if command == "mql" and plan_filename != None and shard_index == None:
+            sys.stderr.write("ERROR: --plan can only be used with mql together with --shard.\n")
+            sys.exit(1)
+
+        if command == "mql" and shard_index != None:
+            if plan_filename == None or len(args) != 1:
+                usage()
+                sys.exit(1)
+            # The plan decides the files and the ranges, and the
+            # shards are written as plain MQL.
+            for (bIsGiven, option) in [(first_monad != None, "--first-monad"),
+                                       (first_id_d != None, "--first-id-d"),
+                                       (object_stream_filename != None, "--save-objects"),
+                                       (dedup_mode != None, "--skip-duplicates"),
+                                       (dedup_index_filename != None, "--duplicate-index"),
+                                       (len(also_list) > 0, "--also"),
+                                       (split_element != None, "--split-element"),
+                                       (index_filename != None, "--index"),
+                                       (profile_filename != None, "--profile")]:
+                if bIsGiven:
+                    sys.stderr.write("ERROR: %s cannot be used with --shard.\n" % option)
+                    sys.exit(1)
+            xml2mql.generateShardMQL(args[0], plan_filename, shard_index, read_ahead, max_prefetch_bytes, writer_mode, max_documents_in_flight, selection, catalog_directory, mql_file)
+            if mql_file != None:
+                mql_file.close()
+                sys.stderr.write("Executed %d statements in Emdros database %s.\n" % (mql_file.statement_count, emdros_database))
+            sys.exit(0)
+
+        if len(args) < 2:
+            usage()
+            sys.exit(1)
         
-        json_filename = sys.argv[2]
-        xml_filenames = sys.argv[3:]
+        json_filename = args[0]
+        xml_filenames = args[1:]
+
+        if dedup_index_filename != None and dedup_mode == None:
+            dedup_mode = "raw"
 
-        first_monad = 1
-        first_id_d = 1
+        if first_monad == None:
+            first_monad = 1
+        if first_id_d == None:
+            first_id_d = 1
         default_token_name = "token"
         default_document_name = "document"
 
-        if command == "mql":
-            xml2mql.generateMQL(json_filename, xml_filenames, first_monad, first_id_d, default_document_name, default_token_name)
+        if command == "mql" and split_element != None:
+            if index_filename != None:
+                sys.stderr.write("ERROR: --index cannot be used with --split-element.\n")
+                sys.exit(1)
+            if profile_filename != None:
+                sys.stderr.write("ERROR: --profile cannot be used with --split-element.\n")
+                sys.exit(1)
+            if len(also_list) > 0:
+                sys.stderr.write("ERROR: --also cannot be used with --split-element.\n")
+                sys.exit(1)
+            if read_ahead > 0:
+                sys.stderr.write("ERROR: --prefetch cannot be used with --split-element.\n")
+                sys.exit(1)
+            if object_stream_filename != None:
+                sys.stderr.write("ERROR: --save-objects cannot be used with --split-element.\n")
+                sys.exit(1)
+            xml2mql.generateSplitMQL(json_filename, xml_filenames, first_monad, first_id_d, split_element, split_worker_count, split_chunk_bytes, writer_mode, max_documents_in_flight, selection, catalog_directory, mql_file, dedup_mode, dedup_index_filename, default_document_name, default_token_name)
+            if mql_file != None:
+                mql_file.close()
+                sys.stderr.write("Executed %d statements in Emdros database %s.\n" % (mql_file.statement_count, emdros_database))
+        elif command == "mql":
+            extra_output_list = [(also_json_filename, open(also_mql_filename, "w", encoding='utf-8')) for (also_json_filename, also_mql_filename) in also_list]
+            xml2mql.generateMQL(json_filename, xml_filenames, first_monad, first_id_d, default_document_name, default_token_name, read_ahead, max_prefetch_bytes, writer_mode, max_documents_in_flight, selection, object_stream_filename, catalog_directory, mql_file, dedup_mode, dedup_index_filename, extra_output_list, index_filename, index_object_types, profile_filename)
+            for (also_json_filename, also_fout) in extra_output_list:
+                also_fout.close()
+            if mql_file != None:
+                mql_file.close()
+                sys.stderr.write("Executed %d statements in Emdros database %s.\n" % (mql_file.statement_count, emdros_database))
         elif command == "json":
-            xml2mql.generateJSON(json_filename, xml_filenames, default_document_name, default_token_name)
+            xml2mql.generateJSON(json_filename, xml_filenames, default_document_name, default_token_name, read_ahead, max_prefetch_bytes, catalog_directory)
+        elif command == "plan":
+            xml2mql.generatePlan(json_filename, xml_filenames, plan_filename, shard_count, first_monad, first_id_d, default_document_name, default_token_name, read_ahead, max_prefetch_bytes, catalog_directory)
+        elif command == "count":
+            xml2mql.generateCounts(json_filename, xml_filenames, sys.stdout.buffer, first_monad, first_id_d, default_document_name, default_token_name, read_ahead, max_prefetch_bytes, selection, catalog_directory)
         elif command == "renderjson":
             xml2mql.generateRenderJSON(json_filename, xml_filenames[0])
         else:
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+#
+# XML to Emdros MQL data importer.
+#
+#
+# Copyright (C) 2018  Sandborg-Petersen Holding ApS, Denmark
+#
+# Made available under the MIT License.
+#
+# See the file LICENSE in the root of the sources for the full license
+# text.
+#
+#
+# An asyncio API for turning many XML documents into MQL at once,
+# e.g., in a web service receiving uploads, without blocking the
+# event loop.
+#
+# Each document is parsed in a worker thread into an in-memory
+# object stream (see object_stream), starting at monad 1, id_d 1 and
+# docindex 1.  Only when the parse is finished, and the number of
+# monads, id_ds and docindexes it needs is known, is it given its
+# ranges by a RangeAllocator, and the MQL is re-emitted at those
+# ranges.  So documents which are parsed at the same time never get
+# overlapping monads, id_ds or docindexes, however long each of them
+# takes.
+#
+# Example:
+#
+#   importer = AsyncImporter(open("script.json", "rb"), first_monad, first_id_d)
+#   await importer.writeSchema(writer)
+#   ...
+#   ranges = await importer.importDocument(request.content, writer, "upload.xml")
+#   ...
+#   importer.close()
+#
+import io
+import asyncio
+import inspect
+import threading
+import xml.sax
+import concurrent.futures
+
+from . import mql_generator
+from . import object_stream
+from . import import_plan
+from . import entity_catalog
+
+default_max_workers = 4
+
+read_block_size = 64 * 1024
+write_block_size = 1024 * 1024
+
+class RangeAllocator:
+    """Hands out consecutive, non-overlapping ranges of monads, id_ds
+    and docindexes.  Safe to use from several threads and event
+    loops."""
+    def __init__(self, first_monad, first_id_d, first_docindex = 1):
+        self.lock = threading.Lock()
+        self.curmonad = first_monad
+        self.curid_d = first_id_d
+        self.curdocindex = first_docindex
+
+    def allocate(self, monad_count, id_d_count, docindex_count):
+        """Returns (first_monad, first_id_d, first_docindex) of
+        ranges of monad_count monads, id_d_count id_ds and
+        docindex_count docindexes."""
+        with self.lock:
+            result = (self.curmonad, self.curid_d, self.curdocindex)
+            self.curmonad += monad_count
+            self.curid_d += id_d_count
+            self.curdocindex += docindex_count
+        return result
+
+    def getNext(self):
+        """Returns (monad, id_d, docindex) of the next ranges to be
+        handed out."""
+        with self.lock:
+            return (self.curmonad, self.curid_d, self.curdocindex)
+
+
+async def iterateChunks(stream):
+    """Yields the bytes of an async input, which can be anything
+    with an async read(n) (e.g., an asyncio.StreamReader), an async
+    iterable of bytes, or just bytes."""
+    if hasattr(stream, "read"):
+        while True:
+            chunk = await stream.read(read_block_size)
+            if len(chunk) == 0:
+                break
+            yield chunk
+    elif hasattr(stream, "__aiter__"):
+        async for chunk in stream:
+            yield chunk
+    else:
+        yield stream
+
+async def writeBytes(writer, data):
+    """Writes data to an async output, which can be an
+    asyncio.StreamWriter, or anything with a write() which returns
+    an awaitable."""
+    for index in range(0, len(data), write_block_size):
+        result = writer.write(data[index:index + write_block_size])
+        if inspect.isawaitable(result):
+            await result
+        elif hasattr(writer, "drain"):
+            await writer.drain()
+
+
+class AsyncImporter:
+    """Turns XML documents into MQL concurrently.  The JSON script is
+    read once, when the importer is made.
+
+    At most max_workers documents are parsed at the same time, each
+    in its own worker thread, and only that many documents are held
+    in memory; further calls of importDocument() wait their turn.
+    The MQL written for a document includes neither the header nor
+    the schema; see writeSchema()."""
+    def __init__(self, json_file, first_monad, first_id_d, max_workers = default_max_workers, selection = None, catalog_directory = None, first_docindex = 1):
+        self.script_bytes = b"".join(json_file.readlines())
+        self.selection = selection
+
+        if catalog_directory != None:
+            self.entity_resolver = entity_catalog.CatalogEntityResolver(catalog_directory)
+        else:
+            self.entity_resolver = None
+
+        self.allocator = RangeAllocator(first_monad, first_id_d, first_docindex)
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+        self.max_workers = max_workers
+        self.semaphores = {} # event loop -> asyncio.Semaphore
+
+    def makeHandler(self, mql_file, first_monad, first_id_d):
+        handler = mql_generator.MQLGeneratorHandler(io.BytesIO(self.script_bytes), mql_file, first_monad, first_id_d)
+        if self.selection != None:
+            handler.updateSelection(self.selection)
+        return handler
+
+    def getSemaphore(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self.semaphores:
+            self.semaphores[loop] = asyncio.Semaphore(self.max_workers)
+        return self.semaphores[loop]
+
+    async def writeSchema(self, writer):
+        """Writes the MQL header and schema to the async writer."""
+        handler = self.makeHandler(None, 1, 1)
+        fout = io.StringIO()
+        handler.dumpMQLHeader(fout)
+        handler.dumpMQLSchema(fout)
+        await writeBytes(writer, fout.getvalue().encode('utf-8'))
+
+    def makeParser(self, handler):
+        if self.entity_resolver != None:
+            return self.entity_resolver.makeParser(handler)
+        else:
+            parser = xml.sax.make_parser()
+            parser.setContentHandler(handler)
+            return parser
+
+    def reemitMQL(self, object_stream_bytes, first_monad, first_id_d, first_docindex):
+        fout = io.StringIO()
+        object_stream.reemitMQL(io.BytesIO(object_stream_bytes), fout, first_monad, first_id_d, first_docindex)
+        return fout.getvalue().encode('utf-8')
+
+    async def importDocument(self, stream, writer, basename = None):
+        """Parses the XML document read from the async input stream
+        (see iterateChunks()), and writes its MQL to the async
+        writer (see writeBytes()).  Returns the ranges used, as a
+        dictionary with first_monad, last_monad, first_id_d,
+        last_id_d, first_docindex and last_docindex."""
+        loop = asyncio.get_running_loop()
+
+        async with self.getSemaphore():
+            object_stream_file = io.BytesIO()
+
+            handler = self.makeHandler(None, 1, 1)
+            handler.bSchemaHasBeenDumped = True
+            handler.setBasename(basename)
+            handler.startObjectStream(object_stream_file)
+
+            # The handler is only ever used by one worker thread at
+            # a time, since each feed() is awaited before the next.
+            parser = self.makeParser(handler)
+            async for chunk in iterateChunks(stream):
+                await loop.run_in_executor(self.executor, parser.feed, chunk)
+            await loop.run_in_executor(self.executor, parser.close)
+
+            (first_monad, first_id_d, first_docindex) = self.allocator.allocate(handler.curmonad - 1, handler.curid_d - 1, handler.curdocindex - 1)
+
+            data = await loop.run_in_executor(self.executor, self.reemitMQL, object_stream_file.getvalue(), first_monad, first_id_d, first_docindex)
+
+        await writeBytes(writer, data)
+
+        return import_plan.makeRange([first_monad, first_id_d, first_docindex],
+                                     [first_monad + handler.curmonad - 1, first_id_d + handler.curid_d - 1, first_docindex + handler.curdocindex - 1])
+
+    def close(self):
+        self.executor.shutdown()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#
+# XML to Emdros MQL data importer.
+#
+#
+# Copyright (C) 2018  Sandborg-Petersen Holding ApS, Denmark
+#
+# Made available under the MIT License.
+#
+# See the file LICENSE in the root of the sources for the full license
+# text.
+#
+#
+import io
+import queue
+import threading
+import concurrent.futures
+
+from . import emdros_util
+
+def formatMQLObjectLists(object_lists):
+    fout = io.StringIO()
+    emdros_util.dumpMQLObjectLists(fout, object_lists)
+    return fout.getvalue()
+
+
+class BackgroundWriter:
+    """Writes the objects of finished documents to fout in a
+    background thread, so that parsing of the next document can go
+    on in the meantime.
+
+    submit() takes a list of (objectTypeName, object_list) pairs,
+    i.e., one document's worth of objects.  Documents are written in
+    the order in which they were submitted.  At most max_in_flight
+    documents can be waiting to be written; submit() blocks when
+    that limit is reached.
+
+    If bUseProcesses is True, the MQL text is formatted in a pool of
+    worker processes, and the background thread only writes it.
+
+    An exception raised while writing is re-raised in the parsing
+    thread on the next call to submit() or close().
+    """
+    def __init__(self, fout, max_in_flight = 2, bUseProcesses = False):
+        assert max_in_flight >= 1
+
+        self.fout = fout
+        self.queue = queue.Queue(maxsize = max_in_flight)
+        self.error = None
+
+        if bUseProcesses:
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers = max_in_flight)
+        else:
+            self.executor = None
+
+        self.thread = threading.Thread(target = self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, object_lists):
+        self.checkError()
+
+        if self.executor != None:
+            item = self.executor.submit(formatMQLObjectLists, object_lists)
+        else:
+            item = object_lists
+
+        self.queue.put(item)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            elif self.error != None:
+                # Keep draining the queue so that submit() never
+                # blocks forever.
+                continue
+
+            try:
+                if self.executor != None:
+                    self.fout.write(item.result())
+                else:
+                    emdros_util.dumpMQLObjectLists(self.fout, item)
+            except BaseException as e:
+                self.error = e
+
+    def checkError(self):
+        if self.error != None:
+            raise self.error
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+        if self.executor != None:
+            self.executor.shutdown(wait = True)
+            self.executor = None
+
+        self.checkError()
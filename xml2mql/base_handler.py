@@ -23,12 +23,27 @@ class BaseHandler(xml.sax.ContentHandler):
         self.ignored_elements = set()
         self.handled_elements = set()
 
+    def resetParseState(self):
+        """Forgets any elements left open by a parse which failed."""
+        self.elemstack = []
+        self.charstack = []
+        self.nixing_stack = []
+
     def getCurElement(self):
         if len(self.elemstack) == 0:
             return ""
         else:
             return self.elemstack[-1]
         
+    def setBasename(self, basename):
+        pass
+
+    def startProfiling(self, profiler):
+        """Makes profiler (a tag_profiler.TagProfiler) time the
+        handling of each element.  Handlers which are not profiled are
+        not slowed down."""
+        profiler.install(self)
+
     def characters(self, data):
         self.charstack.append(data)
 
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+#
+# XML to Emdros MQL data importer.
+#
+#
+# Copyright (C) 2018  Sandborg-Petersen Holding ApS, Denmark
+#
+# Made available under the MIT License.
+#
+# See the file LICENSE in the root of the sources for the full license
+# text.
+#
+#
+import io
+
+from . import emdros_util
+from .mql_generator import MQLGeneratorHandler
+
+class CountedObject(emdros_util.UnstoredObject):
+    """Stands in for an SRObject when only the monads of the object
+    and the size of its MQL matter.  Feature values are not stored,
+    only the number of characters they would take up."""
+    def __init__(self, objectTypeName, starting_monad):
+        emdros_util.UnstoredObject.__init__(self, objectTypeName, starting_monad)
+        self.feature_size = 0
+
+    def setStringFeature(self, name, value):
+        # '  name:="value";\n'
+        self.feature_size += len(name) + len(value) + 8
+
+    def setNonStringFeature(self, name, value):
+        # '  name:=value;\n'
+        self.feature_size += len(name) + len(str(value)) + 6
+
+    def estimateMQLSize(self):
+        """Returns the approximate length of what dumpMQL() would
+        write for the object."""
+        if self.fm == self.lm:
+            size = len("CREATE OBJECT FROM MONADS={%d}\n" % self.fm)
+        else:
+            size = len("CREATE OBJECT FROM MONADS={%d-%d}\n" % (self.fm, self.lm))
+        if self.id_d != 0:
+            size += len("WITH ID_D=%d\n" % self.id_d)
+        size += len("[\n]\n") + self.feature_size
+        return size
+
+
+class CountingHandler(MQLGeneratorHandler):
+    """Runs the monad, id_d and docindex accounting of
+    MQLGeneratorHandler without keeping any objects or writing any
+    MQL.  After each document, curmonad, curid_d and curdocindex are
+    exactly what MQLGeneratorHandler would have had.
+
+    getFileCounts() returns the counts for the most recently
+    parsed file."""
+    def __init__(self, json_file, first_monad, first_id_d, first_docindex = 1):
+        MQLGeneratorHandler.__init__(self, json_file, None, first_monad, first_id_d, first_docindex)
+
+        self.tokenObjectTypeNameSet = set(self.script["global_parameters"]["tokenObjectTypeNameList"])
+
+        fout = io.StringIO()
+        self.dumpMQLHeader(fout)
+        self.dumpMQLSchema(fout)
+        self.schema_size = len(fout.getvalue())
+
+        self.startCounts()
+
+    def updateSelection(self, selection):
+        MQLGeneratorHandler.updateSelection(self, selection)
+
+        # For each token object type, the size of a token's MQL
+        # apart from the monad, the id_d, the docindex and the
+        # feature values, and how many features are made from the
+        # prefix, the surface and the suffix.  A derived feature is
+        # taken to be as long as what it is derived from.
+        self.token_sizes = {} # tokenObjectTypeName -> (size, prefix count, surface count, suffix count)
+        for tokenObjectTypeName in self.tokenFeatureFunctions:
+            token = CountedObject("", 0)
+            token.setNonStringFeature(self.docIndexFeatureName, "")
+            source_counts = [0, 0, 0]
+            for (featureName, source, function) in self.tokenFeatureFunctions[tokenObjectTypeName]:
+                token.setStringFeature(featureName, "")
+                source_counts[source] += 1
+            size = len("CREATE OBJECT FROM MONADS={}\nWITH ID_D=\n[\n]\n") + token.feature_size
+            self.token_sizes[tokenObjectTypeName] = (size, source_counts[0], source_counts[1], source_counts[2])
+
+    def startCounts(self):
+        self.first_monad = self.curmonad
+        self.first_id_d = self.curid_d
+        self.object_counts = {} # objectTypeName -> count
+        self.flushed_object_counts = {} # objectTypeName -> count
+        self.token_count = 0
+        self.estimated_size = 0
+
+    def makeObject(self, objectTypeName, starting_monad):
+        return CountedObject(objectTypeName, starting_monad)
+
+    def storeObject(self, obj):
+        if obj.objectTypeName in self.unselectedObjectTypeNames:
+            return
+
+        self.object_counts[obj.objectTypeName] = self.object_counts.get(obj.objectTypeName, 0) + 1
+        if obj.objectTypeName in self.tokenObjectTypeNameSet:
+            self.token_count += 1
+
+        # The size is estimated when the document ends, since
+        # handleElementEnd() may still extend the object.
+        self.objects.setdefault(obj.objectTypeName, []).append(obj)
+
+    def createToken(self, tokenObjectTypeName, prefix, surface, suffix):
+        # Does the same accounting as
+        # MQLGeneratorHandler.createToken() without creating an
+        # object, since tokens are by far the most numerous objects.
+        docindex_increment = min(1, self.script["global_parameters"]["docIndexIncrementBeforeObjectType"].get(tokenObjectTypeName, 1))
+        self.curdocindex += docindex_increment
+
+        # createObject() uses one id_d and one docindex, and the
+        # token is then given the next id_d.
+        docindex = self.curdocindex
+        self.curdocindex += 1
+        self.curid_d += 1
+        id_d = self.curid_d
+        self.curid_d += 1
+
+        monad = self.curmonad
+        self.curmonad += 1
+
+        if tokenObjectTypeName in self.unselectedObjectTypeNames:
+            return
+
+        self.object_counts[tokenObjectTypeName] = self.object_counts.get(tokenObjectTypeName, 0) + 1
+        self.token_count += 1
+
+        (token_size, prefix_count, surface_count, suffix_count) = self.token_sizes[tokenObjectTypeName]
+        self.estimated_size += token_size \
+                               + len("%d%d%d" % (monad, id_d, docindex)) \
+                               + prefix_count * len(prefix) + surface_count * len(surface) + suffix_count * len(suffix)
+
+    def saveTextState(self):
+        tokenObjectTypeName = self.pendingTokenObjectTypeName
+        return (MQLGeneratorHandler.saveTextState(self), self.object_counts.get(tokenObjectTypeName, 0), self.token_count, self.estimated_size)
+
+    def restoreTextState(self, save_point):
+        (base_save_point, object_count, self.token_count, self.estimated_size) = save_point
+        MQLGeneratorHandler.restoreTextState(self, base_save_point)
+        if self.pendingTokenObjectTypeName in self.object_counts:
+            self.object_counts[self.pendingTokenObjectTypeName] = object_count
+
+    def startDocument(self):
+        self.startCounts()
+        MQLGeneratorHandler.startDocument(self)
+
+    def flushObjects(self):
+        for objectTypeName in self.objects:
+            for obj in self.objects[objectTypeName]:
+                self.estimated_size += obj.estimateMQLSize()
+
+        self.objects = {}
+
+        for objectTypeName in self.object_counts:
+            flushed_count = self.object_counts[objectTypeName] - self.flushed_object_counts.get(objectTypeName, 0)
+            if flushed_count > 0:
+                statement_count = flushed_count // 50000 + 1
+                self.estimated_size += statement_count * len("CREATE OBJECTS WITH OBJECT TYPE [%s]\nGO\n" % objectTypeName)
+
+        self.flushed_object_counts = dict(self.object_counts)
+
+    def getFileCounts(self):
+        return {
+            "monads" : self.curmonad - self.first_monad,
+            "id_ds" : self.curid_d - self.first_id_d,
+            "tokens" : self.token_count,
+            "objects" : dict(self.object_counts),
+            "estimated_mql_bytes" : self.estimated_size,
+        }
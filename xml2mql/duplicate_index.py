@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+#
+# XML to Emdros MQL data importer.
+#
+#
+# Copyright (C) 2018  Sandborg-Petersen Holding ApS, Denmark
+#
+# Made available under the MIT License.
+#
+# See the file LICENSE in the root of the sources for the full license
+# text.
+#
+#
+# Finding input files whose contents have been imported before, so
+# that they can be skipped instead of being parsed and loaded again.
+#
+# Files are identified by the SHA-256 of their (decompressed)
+# contents, either as they are ("raw"), or with every run of
+# whitespace turned into a single space and leading and trailing
+# whitespace removed ("canonical"), so that copies which differ only
+# in indentation or line endings are also found.
+#
+# The index can be kept in a JSON file between runs:
+#
+# {
+#   "mode" : "raw",
+#   "documents" : {
+#     "<sha256>" : {
+#       "filename" : "a.xml",
+#       "aliases" : ["copy/a.xml", ...]
+#     },
+#     ...
+#   }
+# }
+#
+# where filename is the file which was imported, and aliases are the
+# files which were skipped as copies of it.
+#
+import os
+import re
+import json
+import hashlib
+
+hash_modes = ["raw", "canonical"]
+
+hash_block_size = 1024 * 1024
+
+whitespace_re = re.compile(rb"\s+")
+
+def hashFile(fin, mode):
+    """Returns the hex SHA-256 of the rest of the binary file fin,
+    hashed according to mode (see hash_modes)."""
+    h = hashlib.sha256()
+    if mode == "raw":
+        while True:
+            block = fin.read(hash_block_size)
+            if len(block) == 0:
+                break
+            h.update(block)
+    elif mode == "canonical":
+        # A whitespace run may be split between blocks, so a space
+        # at the end of a block is held back until it is known not
+        # to be followed by more whitespace or the end of the file.
+        bPendingSpace = False
+        bAtStart = True
+        while True:
+            block = fin.read(hash_block_size)
+            if len(block) == 0:
+                break
+            block = whitespace_re.sub(b" ", block)
+            if block.startswith(b" "):
+                bPendingSpace = True
+                block = block[1:]
+            if len(block) == 0:
+                continue
+            if bPendingSpace and not bAtStart:
+                h.update(b" ")
+            bPendingSpace = block.endswith(b" ")
+            if bPendingSpace:
+                block = block[:-1]
+            h.update(block)
+            bAtStart = False
+    else:
+        raise Exception("Error: Unknown hash mode '%s'." % mode)
+
+    return h.hexdigest()
+
+
+class DuplicateIndex:
+    """Remembers the hashes of the files imported so far, in this
+    run and (if index_filename is given) in earlier runs."""
+    def __init__(self, mode, index_filename = None):
+        if mode not in hash_modes:
+            raise Exception("Error: Unknown hash mode '%s'." % mode)
+
+        self.mode = mode
+        self.index_filename = index_filename
+        self.documents = {} # hash -> { "filename", "aliases" }
+
+        self.file_count = 0
+        self.duplicate_count = 0
+
+        if index_filename != None and os.path.exists(index_filename):
+            self.load()
+
+    def load(self):
+        fin = open(self.index_filename, "rb")
+        index = json.loads(fin.read().decode('utf-8'))
+        fin.close()
+
+        if index["mode"] != self.mode:
+            raise Exception("Error: The duplicate index %s uses hash mode '%s', not '%s'." % (self.index_filename, index["mode"], self.mode))
+
+        self.documents = index["documents"]
+
+    def save(self):
+        if self.index_filename == None:
+            return
+
+        index = {
+            "mode" : self.mode,
+            "documents" : self.documents,
+        }
+
+        fout = open(self.index_filename, "wb")
+        fout.write(json.dumps(index, indent = 1, sort_keys = True).encode('utf-8'))
+        fout.close()
+
+    def checkFile(self, filename, fin):
+        """Hashes the seekable binary file fin, and rewinds it.
+        Returns the name of the file it is a copy of, or None if it
+        has not been seen before, in which case it is remembered."""
+        hash_value = hashFile(fin, self.mode)
+        fin.seek(0)
+
+        return self.checkHash(filename, hash_value)
+
+    def checkHash(self, filename, hash_value):
+        """Like checkFile(), for a file whose hash (in this index's
+        mode) is already known."""
+        self.file_count += 1
+
+        if hash_value in self.documents:
+            document = self.documents[hash_value]
+            document["aliases"].append(filename)
+            self.duplicate_count += 1
+            return document["filename"]
+        else:
+            self.documents[hash_value] = {
+                "filename" : filename,
+                "aliases" : [],
+            }
+            return None
+
+    def reportStatistics(self, fout):
+        fout.write("Duplicate files: %d of %d skipped\n" % (self.duplicate_count, self.file_count))
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+#
+# XML to Emdros MQL data importer.
+#
+#
+# Copyright (C) 2018  Sandborg-Petersen Holding ApS, Denmark
+#
+# Made available under the MIT License.
+#
+# See the file LICENSE in the root of the sources for the full license
+# text.
+#
+#
+# Sending the generated MQL straight into an Emdros database through
+# the Emdros Python bindings (EmdrosPy), instead of writing it out
+# for the mql program to parse.
+#
+import re
+
+backend_names = ["sqlite3", "postgresql", "mysql", "bpt"]
+
+# A line consisting of GO ends a statement.  String values are
+# mangled by emdros_util.mangleMQLString(), so they never contain a
+# raw newline, and such a line can only be a statement terminator.
+statement_end_re = re.compile(r"^GO\n", re.MULTILINE)
+
+class EmdrosSink:
+    """A file-like object which executes the MQL written to it in an
+    Emdros environment, one statement at a time, as soon as each
+    statement is complete.  Since MQLGeneratorHandler writes at most
+    emdros_util.max_objects_in_statement objects per CREATE OBJECTS
+    statement, those are the batches sent to Emdros.
+
+    env can be an EmdrosPy.EmdrosEnv, or anything else with the same
+    executeString(), getDBError() and getCompilerError() methods:
+    executeString(mql, bPrintResult, bReportError) must return a
+    (bDBOK, bCompilerOK) pair.  An Exception is raised on the first
+    statement which fails.
+    """
+    def __init__(self, env):
+        self.env = env
+        self.pending_list = [] # Whole lines of the current statement
+        self.partial_line = ""
+        self.statement_count = 0
+
+    def write(self, text):
+        # The unfinished last line of earlier writes is searched
+        # again, since a GO may be split across writes.
+        data = self.partial_line + text
+
+        start = 0
+        for mo in statement_end_re.finditer(data):
+            self.pending_list.append(data[start:mo.end()])
+            self.executeStatement("".join(self.pending_list))
+            self.pending_list = []
+            start = mo.end()
+
+        end_of_last_line = data.rfind("\n", start) + 1
+        if end_of_last_line > start:
+            self.pending_list.append(data[start:end_of_last_line])
+            start = end_of_last_line
+        self.partial_line = data[start:]
+
+    def executeStatement(self, mql):
+        (bDBOK, bCompilerOK) = self.env.executeString(mql, False, False)
+        if not bCompilerOK:
+            raise Exception("Error: Emdros could not compile statement %d:\n%s\n%s" % (self.statement_count + 1, self.env.getCompilerError(), mql[:1000]))
+        elif not bDBOK:
+            raise Exception("Error: Emdros database error in statement %d:\n%s\n%s" % (self.statement_count + 1, self.env.getDBError(), mql[:1000]))
+
+        self.statement_count += 1
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """Executes whatever is left, unless it is only whitespace or
+        comments."""
+        rest = "".join(self.pending_list) + self.partial_line
+        self.pending_list = []
+        self.partial_line = ""
+
+        for line in rest.split("\n"):
+            line = line.strip()
+            if line != "" and not line.startswith("//"):
+                self.executeStatement(rest)
+                break
+
+
+def openEmdrosEnv(database, backend_name = "sqlite3", hostname = "localhost", user = "emdf", password = ""):
+    """Opens an Emdros environment on an existing database.
+    Requires the Emdros Python bindings."""
+    try:
+        import EmdrosPy
+    except ImportError:
+        raise Exception("Error: The Emdros Python bindings (EmdrosPy) are not installed.")
+
+    backend_kinds = {
+        "sqlite3" : EmdrosPy.kSQLite3,
+        "postgresql" : EmdrosPy.kPostgreSQL,
+        "mysql" : EmdrosPy.kMySQL,
+        "bpt" : EmdrosPy.kBPT,
+    }
+
+    env = EmdrosPy.EmdrosEnv(EmdrosPy.kOKConsole, EmdrosPy.kCSUTF8, hostname, user, password, database, backend_kinds[backend_name])
+    if not env.connectionOk():
+        raise Exception("Error: Could not connect to Emdros database %s:\n%s" % (database, env.getDBError()))
+
+    return env
@@ -137,4 +137,76 @@ class SRObject:
 
         str_result = "\n".join(result)
         fout.write(str_result)
-        
+
+class UnstoredObject(SRObject):
+    """Stands in for an SRObject which is not going to be written,
+    but whose monads still matter.  Features are not stored."""
+    def __init__(self, objectTypeName, starting_monad):
+        self.objectTypeName = objectTypeName
+        self.fm = starting_monad
+        self.lm = starting_monad
+        self.id_d = 0
+
+    def setStringFeature(self, name, value):
+        pass
+
+    def setNonStringFeature(self, name, value):
+        pass
+
+
+def dumpMQLObjectLists(fout, object_lists):
+    for (objectTypeName, object_list) in object_lists:
+        dumpMQLObjectType(fout, objectTypeName, object_list)
+
+max_objects_in_statement = 50000
+
+class FormattedObjects:
+    """Stands in, in an object list, for a run of objects whose MQL
+    has already been formatted, one string per object."""
+    def __init__(self, text_list):
+        self.text_list = text_list
+
+    def dumpMQLBatched(self, fout, objectTypeName, count):
+        """Writes the objects as dumpMQLObjectType() would, with
+        count objects already in the statement.  Returns the count
+        afterwards."""
+        text_list = self.text_list
+        index = 0
+        while index < len(text_list):
+            room = max_objects_in_statement - 1 - count
+            if room <= 0:
+                fout.write("GO\n")
+                fout.write("CREATE OBJECTS WITH OBJECT TYPE [%s]\n" % objectTypeName)
+                fout.write(text_list[index])
+                index += 1
+                count = 0
+            else:
+                end = min(len(text_list), index + room)
+                fout.write("".join(text_list[index:end]))
+                count += end - index
+                index = end
+        return count
+
+
+def dumpMQLObjectType(fout, objectTypeName, object_list):
+    if len(object_list) == 0:
+        return
+    
+    max_in_statement = max_objects_in_statement
+
+    fout.write("CREATE OBJECTS WITH OBJECT TYPE [%s]\n" % objectTypeName)
+
+    count = 0
+    for obj in object_list:
+        if isinstance(obj, FormattedObjects):
+            count = obj.dumpMQLBatched(fout, objectTypeName, count)
+            continue
+        count += 1
+        if count == max_in_statement:
+            fout.write("GO\n")
+            fout.write("CREATE OBJECTS WITH OBJECT TYPE [%s]\n" % objectTypeName)
+            count = 0
+        obj.dumpMQL(fout)
+
+
+    fout.write("GO\n")
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+# XML to Emdros MQL data importer.
+#
+#
+# Copyright (C) 2018  Sandborg-Petersen Holding ApS, Denmark
+#
+# Made available under the MIT License.
+#
+# See the file LICENSE in the root of the sources for the full license
+# text.
+#
+#
+# Resolving DTDs and external entities from a local catalog
+# directory, never from the network.
+#
+# The catalog directory may contain a file called catalog.json,
+# mapping public and system IDs to files in the directory:
+#
+# {
+#   "public" : {
+#     "-//TEI P4//DTD Main Document Type//EN" : "tei2.dtd"
+#   },
+#   "system" : {
+#     "http://www.tei-c.org/Guidelines/DTD/tei2.dtd" : "tei2.dtd"
+#   }
+# }
+#
+# IDs not in catalog.json are looked up by the last component of the
+# system ID, first in the catalog directory, then in the directory of
+# the XML file being parsed.
+#
+import os
+import io
+import json
+import xml.sax
+import xml.sax.handler
+import xml.sax.xmlreader
+
+catalog_filename = "catalog.json"
+
+class CatalogEntityResolver(xml.sax.handler.EntityResolver):
+    """Resolves external entities (including the external DTD
+    subset) to local files.  Each file is read only once per run,
+    and kept in memory for all later documents.  An Exception is
+    raised for entities which cannot be found locally."""
+    def __init__(self, catalog_directory):
+        self.catalog_directory = catalog_directory
+        self.public_map = {} # publicId -> local path
+        self.system_map = {} # systemId -> local path
+
+        self.cache = {} # local path -> bytes
+        self.load_count = 0
+        self.hit_count = 0
+
+        self.document_directory = None
+
+        self.loadCatalog()
+
+    def loadCatalog(self):
+        pathname = os.path.join(self.catalog_directory, catalog_filename)
+        if not os.path.exists(pathname):
+            return
+
+        fin = open(pathname, "rb")
+        catalog = json.loads(fin.read().decode('utf-8'))
+        fin.close()
+
+        for (publicId, filename) in catalog.get("public", {}).items():
+            self.public_map[publicId] = os.path.join(self.catalog_directory, filename)
+        for (systemId, filename) in catalog.get("system", {}).items():
+            self.system_map[systemId] = os.path.join(self.catalog_directory, filename)
+
+    def setDocumentFilename(self, filename):
+        self.document_directory = os.path.dirname(os.path.abspath(filename))
+
+    def findLocalFile(self, publicId, systemId):
+        if publicId != None and publicId in self.public_map:
+            return self.public_map[publicId]
+        elif systemId != None and systemId in self.system_map:
+            return self.system_map[systemId]
+        elif systemId == None:
+            return None
+
+        basename = systemId.replace("\\", "/").split("/")[-1]
+        if basename == "":
+            return None
+
+        for directory in [self.catalog_directory, self.document_directory]:
+            if directory != None:
+                pathname = os.path.join(directory, basename)
+                if os.path.isfile(pathname):
+                    return pathname
+
+        return None
+
+    def resolveEntity(self, publicId, systemId):
+        pathname = self.findLocalFile(publicId, systemId)
+        if pathname == None:
+            raise Exception("Error: Entity with public ID %s and system ID %s is not in the catalog in %s." % (publicId, systemId, self.catalog_directory))
+
+        if pathname in self.cache:
+            self.hit_count += 1
+        else:
+            fin = open(pathname, "rb")
+            self.cache[pathname] = fin.read()
+            fin.close()
+            self.load_count += 1
+
+        source = xml.sax.xmlreader.InputSource(pathname)
+        source.setPublicId(publicId)
+        source.setByteStream(io.BytesIO(self.cache[pathname]))
+        return source
+
+    def makeParser(self, handler):
+        """Returns a SAX parser for handler which resolves external
+        entities from the catalog."""
+        parser = xml.sax.make_parser()
+        parser.setFeature(xml.sax.handler.feature_external_ges, True)
+        parser.setEntityResolver(self)
+        parser.setContentHandler(handler)
+        return parser
+
+    def parse(self, fin, handler):
+        """Like xml.sax.parse(fin, handler), but with external
+        entities resolved from the catalog."""
+        self.makeParser(handler).parse(fin)
+
+    def reportStatistics(self, fout):
+        fout.write("Entity catalog: %d files loaded, %d cache hits\n" % (self.load_count, self.hit_count))
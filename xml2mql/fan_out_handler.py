@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+#
+# XML to Emdros MQL data importer.
+#
+#
+# Copyright (C) 2018  Sandborg-Petersen Holding ApS, Denmark
+#
+# Made available under the MIT License.
+#
+# See the file LICENSE in the root of the sources for the full license
+# text.
+#
+#
+# Passing each SAX event on to several handlers, so that one parse of
+# the XML can produce the output of several JSON scripts.
+#
+import xml.sax
+
+from . import latin_tokenizer
+
+class FanOutHandler(xml.sax.ContentHandler):
+    """Passes each SAX event on to each of handler_list, in order.
+    Handlers with a tokenizer (such as MQLGeneratorHandler) are made
+    to share one latin_tokenizer.SharedTokenizer, so that text which
+    several of them tokenize is only tokenized once."""
+    def __init__(self, handler_list):
+        xml.sax.ContentHandler.__init__(self)
+        self.handler_list = handler_list
+
+        self.tokenizer = latin_tokenizer.SharedTokenizer()
+        for handler in self.handler_list:
+            if hasattr(handler, "tokenizer"):
+                handler.tokenizer = self.tokenizer
+
+    def setBasename(self, basename):
+        for handler in self.handler_list:
+            handler.setBasename(basename)
+
+    def setDocumentLocator(self, locator):
+        for handler in self.handler_list:
+            handler.setDocumentLocator(locator)
+
+    def startDocument(self):
+        self.tokenizer.nextEvent()
+        for handler in self.handler_list:
+            handler.startDocument()
+
+    def endDocument(self):
+        self.tokenizer.nextEvent()
+        for handler in self.handler_list:
+            handler.endDocument()
+
+    def startElement(self, tag, attributes):
+        self.tokenizer.nextEvent()
+        for handler in self.handler_list:
+            handler.startElement(tag, attributes)
+
+    def endElement(self, tag):
+        self.tokenizer.nextEvent()
+        for handler in self.handler_list:
+            handler.endElement(tag)
+
+    def characters(self, data):
+        self.tokenizer.nextEvent()
+        for handler in self.handler_list:
+            handler.characters(data)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#
+# XML to Emdros MQL data importer.
+#
+#
+# Copyright (C) 2018  Sandborg-Petersen Holding ApS, Denmark
+#
+# Made available under the MIT License.
+#
+# See the file LICENSE in the root of the sources for the full license
+# text.
+#
+#
+# An import plan assigns each XML file, and each shard (a run of
+# consecutive files), the monads, id_ds and docindexes it will use,
+# so that shards can be turned into MQL independently (e.g., on
+# different machines) and still fit together without overlaps or
+# gaps.
+#
+# The plan is a JSON object:
+#
+# {
+#   "shards" : [
+#     {
+#       "shard" : 0,
+#       "first_monad" : 1, "last_monad" : 1234,
+#       "first_id_d" : 1, "last_id_d" : 2345,
+#       "first_docindex" : 1, "last_docindex" : 3456,
+#       "files" : [
+#         { "filename" : "a.xml", "first_monad" : 1, ... },
+#         ...
+#       ]
+#     },
+#     ...
+#   ]
+# }
+#
+# A "last" value which is one less than the "first" value denotes an
+# empty range.
+#
+import os
+import json
+
+range_names = ["monad", "id_d", "docindex"]
+
+shard_trailer_prefix = "// xml2emdrosmql shard: "
+
+def makeRange(first_list, next_list):
+    """Returns a dictionary with first_X/last_X for each of
+    range_names, given the first values and the values following the
+    last values."""
+    result = {}
+    for index in range(0, len(range_names)):
+        result["first_" + range_names[index]] = first_list[index]
+        result["last_" + range_names[index]] = next_list[index] - 1
+    return result
+
+def getFirstList(range_dict):
+    return [range_dict["first_" + name] for name in range_names]
+
+def getNextList(range_dict):
+    return [range_dict["last_" + name] + 1 for name in range_names]
+
+def makeShards(file_entry_list, shard_count):
+    """Splits the file entries into at most shard_count runs of
+    consecutive files with roughly the same number of monads each."""
+    shard_count = max(1, min(shard_count, len(file_entry_list)))
+
+    total_monads = sum([entry["last_monad"] - entry["first_monad"] + 1 for entry in file_entry_list])
+
+    # A shard ends before a file if that leaves the monads so far
+    # closer to the shard's share of the total than taking the file
+    # would.
+    shard_file_lists = [[]]
+    monads_so_far = 0
+    for entry in file_entry_list:
+        monad_count = entry["last_monad"] - entry["first_monad"] + 1
+        boundary = total_monads * len(shard_file_lists) / shard_count
+        if len(shard_file_lists[-1]) > 0 \
+           and abs(boundary - monads_so_far) <= abs(monads_so_far + monad_count - boundary) \
+           and len(shard_file_lists) < shard_count:
+            shard_file_lists.append([])
+        shard_file_lists[-1].append(entry)
+        monads_so_far += monad_count
+
+    shard_list = []
+    for shard_index in range(0, len(shard_file_lists)):
+        files = shard_file_lists[shard_index]
+        shard = makeRange(getFirstList(files[0]), getNextList(files[-1]))
+        shard["shard"] = shard_index
+        shard["files"] = files
+        shard_list.append(shard)
+
+    return shard_list
+
+def checkContiguous(range_list, what):
+    """Raises an Exception unless each range starts right after the
+    previous one ends."""
+    for index in range(1, len(range_list)):
+        prev_next_list = getNextList(range_list[index - 1])
+        first_list = getFirstList(range_list[index])
+        for name_index in range(0, len(range_names)):
+            if first_list[name_index] < prev_next_list[name_index]:
+                raise Exception("Error: %s %d overlaps the previous one in its %s range." % (what, index, range_names[name_index]))
+            elif first_list[name_index] > prev_next_list[name_index]:
+                raise Exception("Error: %s %d leaves a gap after the previous one in its %s range." % (what, index, range_names[name_index]))
+
+def checkPlan(plan):
+    checkContiguous(plan["shards"], "Shard")
+    for shard in plan["shards"]:
+        checkContiguous(shard["files"], "File")
+        if getFirstList(shard) != getFirstList(shard["files"][0]) \
+           or getNextList(shard) != getNextList(shard["files"][-1]):
+            raise Exception("Error: Shard %d's ranges do not match its files." % shard["shard"])
+
+def loadPlan(plan_filename):
+    fin = open(plan_filename, "rb")
+    plan = json.loads(fin.read().decode('utf-8'))
+    fin.close()
+
+    checkPlan(plan)
+
+    return plan
+
+def writePlan(plan, plan_filename):
+    fout = open(plan_filename, "wb")
+    fout.write(json.dumps(plan, indent = 1, sort_keys = True).encode('utf-8'))
+    fout.close()
+
+def makeShardTrailer(shard_range):
+    return shard_trailer_prefix + json.dumps(shard_range, sort_keys = True) + "\n"
+
+def readShardTrailer(mql_filename):
+    """Returns the shard range written at the end of a shard's MQL
+    output, or None if the shard did not finish."""
+    fin = open(mql_filename, "rb")
+    fin.seek(0, os.SEEK_END)
+    size = fin.tell()
+    fin.seek(max(0, size - 4096))
+    tail = fin.read().decode('utf-8', 'replace')
+    fin.close()
+
+    # The trailer is the last thing a shard writes, so anything but
+    # a complete trailer line means the shard did not finish.
+    if not tail.endswith("\n"):
+        return None
+
+    last_line = tail[:-1].split("\n")[-1]
+    if not last_line.startswith(shard_trailer_prefix):
+        return None
+
+    try:
+        return json.loads(last_line[len(shard_trailer_prefix):])
+    except ValueError:
+        return None
@@ -11,6 +11,8 @@
 # text.
 #
 #
+import re
+
 token_split_chars = " \n\r\t-"
 
 token_non_surface_chars = token_split_chars + ".,;:?\"()[]"
@@ -18,86 +20,121 @@ token_non_surface_chars = token_split_chars + ".,;:?\"()[]"
 state_after = 0
 state_in = 1
 
+# The prefix is the leading non-surface characters, the surface is
+# the run of surface characters after it, and the suffix is the rest.
+split_token_re = re.compile(r"([%(ns)s]*)([^%(ns)s]*)(.*)" % { "ns" : re.escape(token_non_surface_chars) }, re.DOTALL)
+
+# Matches the last split character before the start of a new token.
+token_start_re = re.compile(r"[%(s)s](?=[^%(s)s])" % { "s" : re.escape(token_split_chars) })
+
 def tokenize_string(instring):
     """Takes a string as input, returns a list of (prefix, surface,
     suffix) strings.  Assumes a Western (Latin) character set."""
+    tokenizer = Tokenizer()
+    result_list = tokenizer.feed(instring)
+    result_list.extend(tokenizer.finish())
+    return result_list
+
+
+def split_token(tmp_str):
+    """Splits one raw token string (the surface plus any surrounding
+    punctuation and trailing whitespace) into a (prefix, surface,
+    suffix) tuple."""
+    mo = split_token_re.match(tmp_str)
+    return mo.group(1, 2, 3)
+
+
+class Tokenizer:
+    """Resumable version of tokenize_string().
+
+    Text can be fed in arbitrary chunks (e.g., as they arrive from
+    SAX characters() callbacks).  feed() returns the tokens which
+    were completed by the chunk, while finish() returns whatever is
+    left and makes the tokenizer ready for the next string.  Only the
+    token currently being scanned is kept in memory.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.state = None # No characters seen yet
+        self.piece_list = []
+        self.piece_length = 0
+
+    def feed(self, chunk):
+        result_list = []
+
+        if len(chunk) == 0:
+            return result_list
+
+        start = 0
+        if self.state == state_after and chunk[0] not in token_split_chars:
+            # A new token starts right at the beginning of the chunk.
+            result_list.append(split_token("".join(self.piece_list)))
+            self.piece_list = []
+            self.piece_length = 0
+
+        for mo in token_start_re.finditer(chunk):
+            index = mo.end()
+            self.piece_list.append(chunk[start:index])
+            result_list.append(split_token("".join(self.piece_list)))
+            self.piece_list = []
+            self.piece_length = 0
+            start = index
 
-    tmp_list = []
-
-    if len(instring) == 0:
-        return []
-    if instring[0] in token_split_chars:
-        state = state_after
-    else:
-        state = state_in
-
-    start = 0
-    for index in range(0, len(instring)):
-        c = instring[index]
-        if c in token_split_chars:
-            if state == state_after:
-                pass
-            elif state == state_in:
-                state = state_after
-            else:
-                assert False, "Unhandled state: %s\n" % state
+        if start < len(chunk):
+            self.piece_list.append(chunk[start:])
+            self.piece_length += len(chunk) - start
+
+        if chunk[-1] in token_split_chars:
+            self.state = state_after
         else:
-            if state == state_in:
-                pass
-            elif state == state_after:
-                tmp_str = instring[start:index]
-                start = index
-                tmp_list.append(tmp_str)
-                state = state_in
-            else:
-                assert False, "Unhandled state: %s\n" % state
-
-
-    if start < len(instring)-1:
-        tmp_str = instring[start:]
-        tmp_list.append(tmp_str)
-
-    result_list = []
-
-    st_prefix = 0
-    st_surface = 1
-    st_suffix = 2
-
-    for tmp_str in tmp_list:
-        state = st_prefix
-        prefix_list = []
-        surface_list = []
-        suffix_list = []
-        for index in range(0, len(tmp_str)):
-            c = tmp_str[index]
-            if c in token_non_surface_chars:
-                if state == st_prefix:
-                    prefix_list.append(c)
-                elif state == st_surface:
-                    state = st_suffix
-                    suffix_list.append(c)
-                elif state == st_suffix:
-                    suffix_list.append(c)
-                else:
-                    assert False, "Unhandled state: %s\n" % state
-            else:
-                if state == st_prefix:
-                    state = st_surface
-                    surface_list.append(c)
-                elif state == st_surface:
-                    surface_list.append(c)
-                elif state == st_suffix:
-                    suffix_list.append(c)
-                else:
-                    assert False, "Unhandled state: %s\n" % state
-
-        prefix = "".join(prefix_list)
-        surface = "".join(surface_list)
-        suffix = "".join(suffix_list)
-
-        result_list.append((prefix, surface, suffix))
-
-        
-    return result_list
-        
-    
+            self.state = state_in
+
+        return result_list
+
+    def finish(self):
+        # Like tokenize_string() always has done, drop a trailing
+        # piece which is only one character long.
+        if self.piece_length > 1:
+            result_list = [split_token("".join(self.piece_list))]
+        else:
+            result_list = []
+
+        self.reset()
+
+        return result_list
+
+
+class SharedTokenizer:
+    """Lets several handlers which get the same SAX events (see
+    fan_out_handler) share one Tokenizer.  nextEvent() must be called
+    before each event.  The first feed() or finish() in an event does
+    the work, and the other handlers get the same tokens back.
+
+    This works because a handler either tokenizes all of the text
+    between two tags or none of it, and finishes at the next tag, so
+    all the handlers which tokenize the text feed the same chunks."""
+    def __init__(self):
+        self.tokenizer = Tokenizer()
+        self.event_serial = 0
+        self.result_serial = -1
+        self.result_list = []
+
+    def nextEvent(self):
+        self.event_serial += 1
+
+    def reset(self):
+        self.tokenizer.reset()
+
+    def feed(self, chunk):
+        if self.result_serial != self.event_serial:
+            self.result_list = self.tokenizer.feed(chunk)
+            self.result_serial = self.event_serial
+        return self.result_list
+
+    def finish(self):
+        if self.result_serial != self.event_serial:
+            self.result_list = self.tokenizer.finish()
+            self.result_serial = self.event_serial
+        return self.result_list
@@ -14,10 +14,15 @@
 import sys
 import os
 import re
+import io
 import json
 
 from . import latin_tokenizer
 from . import emdros_util
+from . import background_writer
+from . import object_stream
+from . import token_features
+from . import sidecar_index
 from .base_handler import BaseHandler
 
 def getBasename(pathname):
@@ -31,11 +36,18 @@ def mangle_XML_entities(s):
     r = r.replace("\"", "&quot;")
     return r
 
-        
+
+def isSelected(name, included_list, excluded_list):
+    if name in excluded_list:
+        return False
+    elif len(included_list) == 0:
+        return True
+    else:
+        return name in included_list
 
 
 class MQLGeneratorHandler(BaseHandler):
-    def __init__(self, json_file, mql_file, first_monad, first_id_d):
+    def __init__(self, json_file, mql_file, first_monad, first_id_d, first_docindex = 1):
         BaseHandler.__init__(self)
 
         self.bSchemaHasBeenDumped = False
@@ -46,20 +58,62 @@ class MQLGeneratorHandler(BaseHandler):
         
         self.script = json.loads(b"".join(json_file.readlines()).decode('utf-8'))
         self.mql_file = mql_file
+        self.writer = None
+        self.objectStreamWriter = None
+        self.sidecarIndex = None
 
         # objectTypeName -> emdros_util.ObjectTypeDescription
         self.schema = {}
 
-        self.curdocindex = 1
+        self.curdocindex = first_docindex
         self.curmonad = first_monad
         self.curid_d = first_id_d
 
         self.docIndexFeatureName = ""
 
+        # Tokens are produced incrementally from characters()
+        # callbacks, so that huge text nodes are never joined into
+        # one string.  Only text which ends at an end-tag is kept
+        # (see handleChars()), so textSavePoint is where to go back
+        # to if it ends at a start-tag instead.
+        self.tokenizer = latin_tokenizer.Tokenizer()
+        self.pendingTokenObjectTypeName = None
+        self.textSavePoint = None
+
         self.initialize()
 
         self.makeSchema()
 
+        self.updateSelection({})
+
+    def restart(self, mql_file, first_monad, first_id_d, first_docindex = 1):
+        """Makes the handler ready for another run of files, writing
+        to mql_file and starting at the given monad, id_d and
+        docindex, without reading the script again.  The selection
+        is kept."""
+        self.resetParseState()
+
+        self.bSchemaHasBeenDumped = False
+        self.basename = None
+
+        self.objstacks = {}
+        self.objects = {}
+        for tokenObjectTypeName in self.script["global_parameters"]["tokenObjectTypeNameList"]:
+            self.objects.setdefault(tokenObjectTypeName, [])
+
+        self.mql_file = mql_file
+        self.writer = None
+        self.objectStreamWriter = None
+        self.sidecarIndex = None
+
+        self.curdocindex = first_docindex
+        self.curmonad = first_monad
+        self.curid_d = first_id_d
+
+        self.tokenizer.reset()
+        self.pendingTokenObjectTypeName = None
+        self.textSavePoint = None
+
     def initialize(self):
         for tokenObjectTypeName in self.script["global_parameters"]["tokenObjectTypeNameList"]:
             self.objects.setdefault(tokenObjectTypeName, [])
@@ -68,6 +122,11 @@ class MQLGeneratorHandler(BaseHandler):
 
         self.documentObjectTypeName = self.script["global_parameters"].get("documentObjectTypeName", "document")
 
+        # If set, each of these elements becomes a document object of
+        # its own, and objects are written at its end, rather than
+        # making each file one document.
+        self.documentBoundaryElement = self.script["global_parameters"].get("documentBoundaryElement", None)
+
         for element_name in self.script["handled_elements"]:
             self.handled_elements.add(element_name)
             
@@ -79,14 +138,13 @@ class MQLGeneratorHandler(BaseHandler):
             
 
     def makeSchema(self):
+        tokenFeatureList = token_features.getTokenFeatureList(self.script["global_parameters"])
+        self.tokenFeatureNameList = [featureName for (featureName, featureType) in tokenFeatureList]
+
         for tokenObjectTypeName in self.script["global_parameters"]["tokenObjectTypeNameList"]:
             objectTypeDescription = emdros_util.ObjectTypeDescription(tokenObjectTypeName, "WITH SINGLE MONAD OBJECTS")
 
-            for (featureName, featureType) in [
-                    ("pre", "STRING FROM SET"),
-                    ("surface", "STRING WITH INDEX"),
-                    ("post", "STRING FROM SET"),
-                    ("surface_lowcase", "STRING WITH INDEX")]:
+            for (featureName, featureType) in tokenFeatureList:
                 objectTypeDescription.addFeature(featureName, featureType)
 
             objectTypeDescription.addFeature(self.docIndexFeatureName, "INTEGER")
@@ -115,38 +173,119 @@ class MQLGeneratorHandler(BaseHandler):
 
             self.schema[objectTypeName] = objectTypeDescription
 
+    def updateSelection(self, selection):
+        """Adds to the object types and features which are to be
+        written.  selection is a dictionary with any of the following
+        keys, each mapping to a list, just like in the script's
+        global_parameters:
+
+        - includedObjectTypeNameList
+        - excludedObjectTypeNameList
+        - includedFeatureNameList ("objectTypeName.featureName")
+        - excludedFeatureNameList ("objectTypeName.featureName")
+
+        An object type or feature is written if it is not excluded,
+        and either there is no include-list or it is on it.
+        Unselected objects are never built, but they use monads,
+        id_ds and docindexes as usual, so that the output lines up
+        with that of a full run."""
+        global_parameters = self.script["global_parameters"]
+        for key in ["includedObjectTypeNameList", "excludedObjectTypeNameList", "includedFeatureNameList", "excludedFeatureNameList"]:
+            global_parameters[key] = global_parameters.get(key, []) + list(selection.get(key, []))
+
+        for objectTypeName in global_parameters["includedObjectTypeNameList"] + global_parameters["excludedObjectTypeNameList"]:
+            if objectTypeName not in self.schema:
+                raise Exception("Error: Unknown object type '%s' in object type selection." % objectTypeName)
+
+        for name in global_parameters["includedFeatureNameList"] + global_parameters["excludedFeatureNameList"]:
+            (objectTypeName, dot, featureName) = name.partition(".")
+            if objectTypeName not in self.schema or featureName not in self.schema[objectTypeName].features:
+                raise Exception("Error: Unknown feature '%s' in feature selection." % name)
+
+        self.unselectedObjectTypeNames = set()
+        self.unselectedFeatureNames = {} # objectTypeName -> [featureName-list]
+        for objectTypeName in self.schema:
+            if not isSelected(objectTypeName, global_parameters["includedObjectTypeNameList"], global_parameters["excludedObjectTypeNameList"]):
+                self.unselectedObjectTypeNames.add(objectTypeName)
+
+            for featureName in self.schema[objectTypeName].features:
+                if not isSelected(objectTypeName + "." + featureName, global_parameters["includedFeatureNameList"], global_parameters["excludedFeatureNameList"]):
+                    self.unselectedFeatureNames.setdefault(objectTypeName, []).append(featureName)
+
+        # Token features which are not written are never computed.
+        self.tokenFeatureFunctions = {} # tokenObjectTypeName -> [(featureName, source, function)-list]
+        for tokenObjectTypeName in global_parameters["tokenObjectTypeNameList"]:
+            if tokenObjectTypeName in self.unselectedObjectTypeNames:
+                featureName_list = []
+            else:
+                unselected_list = self.unselectedFeatureNames.get(tokenObjectTypeName, [])
+                featureName_list = [featureName for featureName in self.tokenFeatureNameList if featureName not in unselected_list]
+            self.tokenFeatureFunctions[tokenObjectTypeName] = token_features.compileTokenFeatures(featureName_list)
+
     def setBasename(self, basename):
         self.basename = basename
             
-    def handleChars(self, chars_before, tag, bIsEndTag):
-        if not bIsEndTag:
-            bDoIt = False
-        elif tag not in self.script["handled_elements"]:
-            bDoIt = False
-        elif self.script["handled_elements"][tag].get("tokenObjectTypeName", None) != None:
-            bDoIt = True
+    def getTokenObjectTypeName(self, tag):
+        if tag not in self.script["handled_elements"]:
+            return None
         else:
-            bDoIt = False
-            
-        if bDoIt:
-            token_list = latin_tokenizer.tokenize_string(chars_before)
+            return self.script["handled_elements"][tag].get("tokenObjectTypeName", None)
 
-            tokenObjectTypeName = self.script["handled_elements"][tag]["tokenObjectTypeName"]
+    def characters(self, data):
+        # Text between two tags is in the current element, so if it
+        # ends at an end-tag, it is that of the current element.
+        tokenObjectTypeName = self.getTokenObjectTypeName(self.getCurElement())
 
-            for (prefix, surface, suffix) in token_list:
+        if tokenObjectTypeName != None:
+            if self.pendingTokenObjectTypeName == None:
+                self.pendingTokenObjectTypeName = tokenObjectTypeName
+                self.textSavePoint = self.saveTextState()
+            
+            for (prefix, surface, suffix) in self.tokenizer.feed(data):
                 self.createToken(tokenObjectTypeName, prefix, surface, suffix)
 
+    def handleChars(self, chars_before, tag, bIsEndTag):
+        # All characters which are to be tokenized have already been
+        # fed to the tokenizer by characters(), so all that is left
+        # is the last token before the tag.  Only the text just
+        # before the end-tag of an element with a tokenObjectTypeName
+        # is tokenized (even inside nixed elements), so the tokens of
+        # text before a start-tag are taken back.
+        if self.pendingTokenObjectTypeName != None:
+            token_list = self.tokenizer.finish()
+            if bIsEndTag:
+                for (prefix, surface, suffix) in token_list:
+                    self.createToken(self.pendingTokenObjectTypeName, prefix, surface, suffix)
+            else:
+                self.restoreTextState(self.textSavePoint)
+
+            self.pendingTokenObjectTypeName = None
+            self.textSavePoint = None
+
+    def saveTextState(self):
+        """Returns what restoreTextState() needs to take back the
+        tokens made from here on."""
+        tokenObjectTypeName = self.pendingTokenObjectTypeName
+        return (self.curmonad, self.curid_d, self.curdocindex, len(self.objects.get(tokenObjectTypeName, [])))
+
+    def restoreTextState(self, save_point):
+        (self.curmonad, self.curid_d, self.curdocindex, object_count) = save_point
+        object_list = self.objects.get(self.pendingTokenObjectTypeName, None)
+        if object_list != None:
+            del object_list[object_count:]
+
     def createToken(self, tokenObjectTypeName, prefix, surface, suffix):
         docindex_increment = min(1, self.script["global_parameters"]["docIndexIncrementBeforeObjectType"].get(tokenObjectTypeName, 1))
         self.curdocindex += docindex_increment
 
-        surface_lowcase = surface.lower()
-
         t = self.createObject(tokenObjectTypeName)
-        t.setStringFeature("pre", prefix)
-        t.setStringFeature("surface", surface)
-        t.setStringFeature("post", suffix)
-        t.setStringFeature("surface_lowcase", surface_lowcase)
+
+        source_list = (prefix, surface, suffix)
+        for (featureName, source, function) in self.tokenFeatureFunctions[tokenObjectTypeName]:
+            if function == None:
+                t.setStringFeature(featureName, source_list[source])
+            else:
+                t.setStringFeature(featureName, function(source_list[source]))
 
         t.setID_D(self.curid_d)
         self.curid_d += 1
@@ -155,8 +294,14 @@ class MQLGeneratorHandler(BaseHandler):
 
         self.endObject(tokenObjectTypeName)
 
+    def makeObject(self, objectTypeName, starting_monad):
+        if objectTypeName in self.unselectedObjectTypeNames:
+            return emdros_util.UnstoredObject(objectTypeName, starting_monad)
+        else:
+            return emdros_util.SRObject(objectTypeName, starting_monad)
+
     def createObject(self, objectTypeName):
-        obj = emdros_util.SRObject(objectTypeName, self.curmonad)
+        obj = self.makeObject(objectTypeName, self.curmonad)
         obj.setID_D(self.curid_d)
         self.curid_d += 1
         
@@ -173,10 +318,21 @@ class MQLGeneratorHandler(BaseHandler):
         
         obj.setLastMonad(self.curmonad - 1)
         
-        self.objects.setdefault(objectTypeName, []).append(obj)
+        self.storeObject(obj)
         
         return obj
 
+    def storeObject(self, obj):
+        if obj.objectTypeName in self.unselectedObjectTypeNames:
+            return
+
+        if obj.objectTypeName in self.unselectedFeatureNames:
+            for featureName in self.unselectedFeatureNames[obj.objectTypeName]:
+                obj.stringFeatures.pop(featureName, None)
+                obj.nonStringFeatures.pop(featureName, None)
+
+        self.objects.setdefault(obj.objectTypeName, []).append(obj)
+
     def getFeatureType(self, tag, attribute):
         assert tag in self.script["handled_elements"], "Logic error: Tag <%s> not in handled elements." % tag
         assert "attributes" in self.script["handled_elements"][tag], "Logic error: Element %s does not have 'attributes' sub-key, yet getFeatureType() was called." % tag
@@ -189,21 +345,74 @@ class MQLGeneratorHandler(BaseHandler):
             return False
 
     def startDocument(self):
+        self.tokenizer.reset()
+        self.pendingTokenObjectTypeName = None
+        self.textSavePoint = None
+
+        if self.documentBoundaryElement != None:
+            # Document objects are made for each boundary element
+            # instead.
+            self.documentOrdinal = 0
+            self.boundaryStack = []
+        else:
+            self.startDocumentObject(self.basename)
+
+    def startDocumentObject(self, basename):
         obj = self.createObject(self.documentObjectTypeName)
-        if self.basename != None:
-            obj.setStringFeature("basename", self.basename)
+        if basename != None:
+            obj.setStringFeature("basename", basename)
+
+        if self.sidecarIndex != None:
+            self.documentIndexEntry = self.sidecarIndex.startEntry(sidecar_index.KIND_DOCUMENT, basename or "", self.documentObjectTypeName, self.curid_d - 1, self.curdocindex - 1)
+
+    def endDocumentObject(self):
+        obj = self.endObject(self.documentObjectTypeName)
+
+        if self.sidecarIndex != None:
+            self.sidecarIndex.endEntry(self.documentIndexEntry, obj, self.curid_d - 1, self.curdocindex - 1)
+            self.documentIndexEntry = None
 
     def endDocument(self):
-        self.endObject(self.documentObjectTypeName)
+        if self.documentBoundaryElement == None:
+            self.endDocumentObject()
         self.basename = None
 
+        self.flushObjects()
+
+    def doActionsBeforeHandleElementStart(self, tag, attributes):
+        if tag == self.documentBoundaryElement:
+            if len(self.nixing_stack) == 0 \
+               and tag not in self.nixed_elements \
+               and True not in self.boundaryStack:
+                self.documentOrdinal += 1
+                if self.basename != None:
+                    self.startDocumentObject("%s#%d" % (self.basename, self.documentOrdinal))
+                else:
+                    self.startDocumentObject(None)
+                self.boundaryStack.append(True)
+            else:
+                self.boundaryStack.append(False)
+
+    def doActionsAfterHandleElementEnd(self, tag):
+        if tag == self.documentBoundaryElement:
+            if self.boundaryStack.pop():
+                self.endDocumentObject()
+                self.flushObjects()
+
+    def flushObjects(self):
+        """Writes all finished objects.  Objects which are still open
+        are written by a later flush."""
         if not self.bSchemaHasBeenDumped:
-            self.mql_file.write("""//
-// Dumped with xml2emdrosmql.py.
-//
+            if self.mql_file != None:
+                self.dumpMQLHeader(self.mql_file)
+                self.dumpMQLSchema(self.mql_file)
+
+            if self.objectStreamWriter != None:
+                fout = io.StringIO()
+                self.dumpMQLHeader(fout)
+                self.dumpMQLSchema(fout)
+                self.objectStreamWriter.writeSchema(fout.getvalue())
 
-""")
-            self.dumpMQLSchema(self.mql_file)
             self.bSchemaHasBeenDumped = True
 
         self.dumpMQLObjects(self.mql_file)
@@ -228,6 +437,12 @@ class MQLGeneratorHandler(BaseHandler):
                         else:
                             obj.setNonStringFeature(featureName, value)
 
+            if self.sidecarIndex != None:
+                if objectTypeName in self.sidecarIndex.indexed_object_types and self.sidecarIndex.id_attribute in attributes:
+                    self.elementIndexEntryStack.append(self.sidecarIndex.startEntry(sidecar_index.KIND_ELEMENT, attributes[self.sidecarIndex.id_attribute], objectTypeName, self.curid_d - 1, self.curdocindex - 1))
+                else:
+                    self.elementIndexEntryStack.append(None)
+
             return True
 
     def handleElementEnd(self, tag):
@@ -243,41 +458,82 @@ class MQLGeneratorHandler(BaseHandler):
                 obj.setLastMonad(self.curmonad)
                 self.curmonad += 1
 
+            if self.sidecarIndex != None:
+                entry = self.elementIndexEntryStack.pop()
+                if entry != None:
+                    self.sidecarIndex.endEntry(entry, obj, self.curid_d - 1, self.curdocindex - 1)
+
             return True
 
     
+    def dumpMQLHeader(self, fout):
+        fout.write("""//
+// Dumped with xml2emdrosmql.py.
+//
+
+""")
+
     def dumpMQLSchema(self, fout):
         for objectTypeName in sorted(self.schema):
+            if objectTypeName in self.unselectedObjectTypeNames:
+                continue
+
             objectTypeDescription = self.schema[objectTypeName]
+
+            if objectTypeName in self.unselectedFeatureNames:
+                selectedTypeDescription = emdros_util.ObjectTypeDescription(objectTypeName, objectTypeDescription.objectRangeType)
+                for featureName in objectTypeDescription.features:
+                    if featureName not in self.unselectedFeatureNames[objectTypeName]:
+                        selectedTypeDescription.addFeature(featureName, objectTypeDescription.features[featureName])
+                objectTypeDescription = selectedTypeDescription
+
             objectTypeDescription.dumpMQL(fout)
     
     def dumpMQLObjects(self, fout):
-        for objectTypeName in sorted(self.objects):
-            self.dumpMQLObjectType(fout, objectTypeName, self.objects[objectTypeName])
+        object_lists = [(objectTypeName, self.objects[objectTypeName]) for objectTypeName in sorted(self.objects)]
 
         del self.objects
         self.objects = {}
 
+        if self.objectStreamWriter != None:
+            self.objectStreamWriter.writeDocument(object_lists)
 
+        if self.writer != None:
+            self.writer.submit(object_lists)
+        elif fout != None:
+            emdros_util.dumpMQLObjectLists(fout, object_lists)
 
     def dumpMQLObjectType(self, fout, objectTypeName, object_list):
-        if len(object_list) == 0:
-            return
-        
-        max_in_statement = 50000
-
-        fout.write("CREATE OBJECTS WITH OBJECT TYPE [%s]\n" % objectTypeName)
-
-        count = 0
-        for obj in object_list:
-            count += 1
-            if count == max_in_statement:
-                fout.write("GO\n")
-                fout.write("CREATE OBJECTS WITH OBJECT TYPE [%s]\n" % objectTypeName)
-                count = 0
-            obj.dumpMQL(fout)
+        emdros_util.dumpMQLObjectType(fout, objectTypeName, object_list)
+
+    def startBackgroundWriter(self, max_in_flight = 2, bUseProcesses = False):
+        """From now on, hand the objects of each finished document
+        to a background writer instead of writing them while the
+        parser waits.  finishOutput() must be called after the last
+        document."""
+        assert self.writer == None
+        self.writer = background_writer.BackgroundWriter(self.mql_file, max_in_flight, bUseProcesses)
+
+    def startObjectStream(self, fout):
+        """Also save the objects of each document from now on to the
+        binary file fout (see object_stream), from which the MQL can
+        be re-emitted later at other monads, id_ds and docindexes.
+        If the handler was given no mql_file, the objects only go
+        there."""
+        assert self.objectStreamWriter == None
+        self.objectStreamWriter = object_stream.ObjectStreamWriter(fout, self.curmonad, self.curid_d, self.curdocindex, self.docIndexFeatureName)
+
+    def startSidecarIndex(self, index_writer):
+        """Also collect the monads, id_ds and docindexes of each
+        document, and of the elements index_writer (a
+        sidecar_index.SidecarIndexWriter) asks for, from now on."""
+        assert self.sidecarIndex == None
+        self.sidecarIndex = index_writer
+        self.documentIndexEntry = None
+        self.elementIndexEntryStack = []
+
+    def finishOutput(self):
+        if self.writer != None:
+            self.writer.close()
+            self.writer = None
 
-
-        fout.write("GO\n")
-
-        
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+#
+# XML to Emdros MQL data importer.
+#
+#
+# Copyright (C) 2018  Sandborg-Petersen Holding ApS, Denmark
+#
+# Made available under the MIT License.
+#
+# See the file LICENSE in the root of the sources for the full license
+# text.
+#
+#
+# A compact binary file holding the objects produced by
+# MQLGeneratorHandler, from which the same MQL can be re-emitted
+# starting at any monad, id_d and docindex, without parsing the XML
+# again.
+#
+# The file starts with object_stream_magic, followed by records.
+# Each record is a type byte, the length of the payload as an
+# unsigned LEB128 varint, and the payload.  Object records use fixed
+# width little-endian fields (see object_struct and feature_struct),
+# so that they can be decoded with a single struct call.
+#
+# RECORD_HEADER    JSON: { "version", "first_monad", "first_id_d" },
+#                  and, if known, "first_docindex" and
+#                  "docIndexFeatureName"
+# RECORD_SCHEMA    The MQL header and schema, UTF-8
+# RECORD_STRING    The next entry of the string table, UTF-8.  Object
+#                  type names, feature names and string values refer
+#                  to strings by their index in this table.
+# RECORD_TYPE      Starts the objects of one object type within a
+#                  document: object type name (string index, varint)
+# RECORD_OBJECT    first monad, last monad - first monad, id_d,
+#                  feature count, and for each feature its name
+#                  (string index), kind (FEATURE_*) and value (an
+#                  integer or a string index)
+# RECORD_DOCUMENT  Ends the objects of one document
+#
+import json
+import struct
+
+from . import emdros_util
+
+object_stream_magic = b"XML2MQLOBJ\n"
+object_stream_version = 1
+
+RECORD_HEADER = 1
+RECORD_SCHEMA = 2
+RECORD_STRING = 3
+RECORD_TYPE = 4
+RECORD_OBJECT = 5
+RECORD_DOCUMENT = 6
+
+FEATURE_STRING = 0 # A string feature
+FEATURE_INTEGER = 1 # A non-string feature with an integer value
+FEATURE_TEXT = 2 # A non-string feature whose value is a string
+
+# first monad, monad length - 1, id_d, feature count
+object_struct = struct.Struct("<IIIH")
+
+# name, kind, value
+feature_struct_format = "Ibi"
+
+min_integer_value = -2**31
+max_integer_value = 2**31 - 1
+
+def encodeVarint(value, result):
+    assert value >= 0
+    while value >= 0x80:
+        result.append((value & 0x7f) | 0x80)
+        value >>= 7
+    result.append(value)
+
+def decodeVarint(data, index):
+    """Returns (value, index of the next byte)."""
+    value = 0
+    shift = 0
+    while True:
+        b = data[index]
+        index += 1
+        value |= (b & 0x7f) << shift
+        if b < 0x80:
+            return (value, index)
+        shift += 7
+
+feature_struct_cache = {} # feature count -> struct.Struct
+
+def getFeatureStruct(feature_count):
+    result = feature_struct_cache.get(feature_count, None)
+    if result == None:
+        result = struct.Struct("<" + feature_struct_format * feature_count)
+        feature_struct_cache[feature_count] = result
+    return result
+
+
+class ObjectStreamWriter:
+    def __init__(self, fout, first_monad, first_id_d, first_docindex = None, docIndexFeatureName = None):
+        self.fout = fout
+        self.string_table = {} # string -> index
+
+        self.fout.write(object_stream_magic)
+        header = {
+            "version" : object_stream_version,
+            "first_monad" : first_monad,
+            "first_id_d" : first_id_d,
+        }
+        if first_docindex != None:
+            header["first_docindex"] = first_docindex
+            header["docIndexFeatureName"] = docIndexFeatureName
+        self.writeRecord(RECORD_HEADER, json.dumps(header).encode('utf-8'))
+
+    def writeRecord(self, record_type, payload):
+        result = bytearray()
+        result.append(record_type)
+        encodeVarint(len(payload), result)
+        result += payload
+        self.fout.write(result)
+
+    def getStringIndex(self, s):
+        index = self.string_table.get(s, None)
+        if index == None:
+            index = len(self.string_table)
+            self.string_table[s] = index
+            self.writeRecord(RECORD_STRING, s.encode('utf-8'))
+        return index
+
+    def writeSchema(self, schema_text):
+        self.writeRecord(RECORD_SCHEMA, schema_text.encode('utf-8'))
+
+    def writeDocument(self, object_lists):
+        """object_lists is a list of (objectTypeName, object_list)
+        pairs, as handed to emdros_util.dumpMQLObjectLists()."""
+        for (objectTypeName, object_list) in object_lists:
+            if len(object_list) == 0:
+                continue
+
+            payload = bytearray()
+            encodeVarint(self.getStringIndex(objectTypeName), payload)
+            self.writeRecord(RECORD_TYPE, payload)
+
+            for obj in object_list:
+                self.writeObject(obj)
+
+        self.writeRecord(RECORD_DOCUMENT, b"")
+
+    def writeObject(self, obj):
+        feature_values = []
+
+        # The order is that of SRObject.dumpMQL().
+        for (name, value) in obj.nonStringFeatures.items():
+            feature_values.append(self.getStringIndex(name))
+            if type(value) == type(0) and min_integer_value <= value <= max_integer_value:
+                feature_values.append(FEATURE_INTEGER)
+                feature_values.append(value)
+            else:
+                feature_values.append(FEATURE_TEXT)
+                feature_values.append(self.getStringIndex(str(value)))
+
+        for (name, value) in obj.stringFeatures.items():
+            feature_values.append(self.getStringIndex(name))
+            feature_values.append(FEATURE_STRING)
+            feature_values.append(self.getStringIndex(value))
+
+        feature_count = len(feature_values) // 3
+        payload = object_struct.pack(obj.fm, obj.lm - obj.fm, obj.id_d, feature_count) \
+                  + getFeatureStruct(feature_count).pack(*feature_values)
+
+        self.writeRecord(RECORD_OBJECT, payload)
+
+
+read_block_size = 1024 * 1024
+
+def readRecords(fin):
+    """Yields (record_type, payload) pairs."""
+    magic = fin.read(len(object_stream_magic))
+    if magic != object_stream_magic:
+        raise Exception("Error: Not an object stream file.")
+
+    data = b""
+    index = 0
+    bAtEOF = False
+    while True:
+        # Make sure that the whole of the next record is in data.
+        # A record type and a length take at most 11 bytes.
+        try:
+            record_type = data[index]
+            (length, payload_index) = decodeVarint(data, index + 1)
+            bComplete = payload_index + length <= len(data)
+        except IndexError:
+            bComplete = False
+
+        if not bComplete:
+            if bAtEOF:
+                if index < len(data):
+                    raise Exception("Error: Truncated object stream file.")
+                break
+
+            block = fin.read(read_block_size)
+            if len(block) == 0:
+                bAtEOF = True
+            data = data[index:] + block
+            index = 0
+            continue
+
+        yield (record_type, data[payload_index:payload_index + length])
+
+        index = payload_index + length
+
+class MQLReemitter:
+    """Writes the MQL for the records of an object stream, in the
+    same way that emdros_util.dumpMQLObjectType() and
+    SRObject.dumpMQL() would have written it, but without building
+    any objects.  Each string is mangled only once."""
+    def __init__(self, fout, first_monad = None, first_id_d = None, first_docindex = None):
+        self.fout = fout
+        self.first_monad = first_monad
+        self.first_id_d = first_id_d
+        self.first_docindex = first_docindex
+        self.monad_offset = 0
+        self.id_d_offset = 0
+        self.docindex_offset = 0
+        self.docIndexFeatureName = None
+
+        self.string_list = []
+        self.mangled_string_list = []
+
+        self.objectTypeName = None
+        self.count = 0 # Objects in the current CREATE OBJECTS statement
+        self.object_count = 0
+
+    def handleRecord(self, record_type, payload):
+        if record_type == RECORD_OBJECT:
+            self.writeObject(payload)
+        elif record_type == RECORD_STRING:
+            s = payload.decode('utf-8')
+            self.string_list.append(s)
+            self.mangled_string_list.append(emdros_util.mangleMQLString(s))
+        elif record_type == RECORD_TYPE:
+            self.endObjectType()
+            (string_index, index) = decodeVarint(payload, 0)
+            self.objectTypeName = self.string_list[string_index]
+            self.fout.write("CREATE OBJECTS WITH OBJECT TYPE [%s]\n" % self.objectTypeName)
+            self.count = 0
+        elif record_type == RECORD_DOCUMENT:
+            self.endObjectType()
+        elif record_type == RECORD_SCHEMA:
+            self.fout.write(payload.decode('utf-8'))
+        elif record_type == RECORD_HEADER:
+            header = json.loads(payload.decode('utf-8'))
+            if header["version"] != object_stream_version:
+                raise Exception("Error: Unsupported object stream version %s." % header["version"])
+            if self.first_monad != None:
+                self.monad_offset = self.first_monad - header["first_monad"]
+            if self.first_id_d != None:
+                self.id_d_offset = self.first_id_d - header["first_id_d"]
+            if self.first_docindex != None:
+                if "first_docindex" not in header:
+                    raise Exception("Error: The object stream does not record its docindexes, so they cannot be moved.")
+                self.docindex_offset = self.first_docindex - header["first_docindex"]
+                self.docIndexFeatureName = header["docIndexFeatureName"]
+        else:
+            raise Exception("Error: Unknown record type %d in object stream file." % record_type)
+
+    def endObjectType(self):
+        if self.objectTypeName != None:
+            self.fout.write("GO\n")
+            self.objectTypeName = None
+
+    def writeObject(self, payload):
+        self.count += 1
+        self.object_count += 1
+        if self.count == emdros_util.max_objects_in_statement:
+            self.fout.write("GO\n")
+            self.fout.write("CREATE OBJECTS WITH OBJECT TYPE [%s]\n" % self.objectTypeName)
+            self.count = 0
+
+        self.fout.write(self.formatObject(payload))
+
+    def formatObject(self, payload):
+        """Returns the MQL of one object, without the CREATE OBJECTS
+        around it."""
+        (fm, length, id_d, feature_count) = object_struct.unpack_from(payload, 0)
+        values = getFeatureStruct(feature_count).unpack_from(payload, object_struct.size)
+
+        fm += self.monad_offset
+        lm = fm + length
+
+        result = []
+        if length == 0:
+            result.append("CREATE OBJECT FROM MONADS={%d}" % fm)
+        else:
+            result.append("CREATE OBJECT FROM MONADS={%d-%d}" % (fm, lm))
+        if id_d != 0:
+            result.append("WITH ID_D=%d" % (id_d + self.id_d_offset))
+        result.append("[")
+
+        string_list = self.string_list
+        for index in range(0, 3 * feature_count, 3):
+            name = string_list[values[index]]
+            kind = values[index + 1]
+            value = values[index + 2]
+            if kind == FEATURE_STRING:
+                result.append("  %s:=\"%s\";" % (name, self.mangled_string_list[value]))
+            elif kind == FEATURE_INTEGER:
+                if name == self.docIndexFeatureName:
+                    value += self.docindex_offset
+                result.append("  %s:=%d;" % (name, value))
+            elif kind == FEATURE_TEXT:
+                if name == self.docIndexFeatureName:
+                    result.append("  %s:=%d;" % (name, int(string_list[value]) + self.docindex_offset))
+                else:
+                    result.append("  %s:=%s;" % (name, string_list[value]))
+            else:
+                raise Exception("Error: Unknown feature kind %d in object stream file." % kind)
+
+        result.append("]")
+        result.append("")
+
+        return "\n".join(result)
+
+def formatObjectLists(fin, first_monad = None, first_id_d = None, first_docindex = None):
+    """Yields, for each document in the object stream file fin, a
+    dictionary mapping each object type name to the list of the MQL
+    of its objects, one string per object, moved as by reemitMQL().
+    The strings are what SRObject.dumpMQL() would have written."""
+    reemitter = MQLReemitter(None, first_monad, first_id_d, first_docindex)
+    text_lists = {}
+    text_list = None
+    for (record_type, payload) in readRecords(fin):
+        if record_type == RECORD_OBJECT:
+            text_list.append(reemitter.formatObject(payload))
+        elif record_type == RECORD_TYPE:
+            (string_index, index) = decodeVarint(payload, 0)
+            text_list = text_lists.setdefault(reemitter.string_list[string_index], [])
+        elif record_type == RECORD_DOCUMENT:
+            yield text_lists
+            text_lists = {}
+        elif record_type in [RECORD_HEADER, RECORD_STRING]:
+            reemitter.handleRecord(record_type, payload)
+        elif record_type != RECORD_SCHEMA:
+            raise Exception("Error: Unknown record type %d in object stream file." % record_type)
+
+def reemitMQL(fin, fout, first_monad = None, first_id_d = None, first_docindex = None):
+    """Writes the MQL for the objects in the object stream file fin
+    to fout, with the monads, id_ds and docindexes moved so that
+    they start at first_monad, first_id_d and first_docindex (if
+    not None).  Returns the number of objects written."""
+    reemitter = MQLReemitter(fout, first_monad, first_id_d, first_docindex)
+    for (record_type, payload) in readRecords(fin):
+        reemitter.handleRecord(record_type, payload)
+    return reemitter.object_count
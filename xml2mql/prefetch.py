@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+#
+# XML to Emdros MQL data importer.
+#
+#
+# Copyright (C) 2018  Sandborg-Petersen Holding ApS, Denmark
+#
+# Made available under the MIT License.
+#
+# See the file LICENSE in the root of the sources for the full license
+# text.
+#
+#
+import io
+import gzip
+import bz2
+import lzma
+import time
+import threading
+import collections
+import concurrent.futures
+
+from . import duplicate_index
+
+default_read_ahead = 2
+default_max_buffered_bytes = 256 * 1024 * 1024
+default_block_size = 1024 * 1024
+
+def openInputFile(filename):
+    """Opens an input file for binary reading, decompressing it on
+    the fly if its extension says it is compressed."""
+    lower_filename = filename.lower()
+    if lower_filename.endswith(".gz"):
+        return gzip.open(filename, "rb")
+    elif lower_filename.endswith(".bz2"):
+        return bz2.open(filename, "rb")
+    elif lower_filename.endswith(".xz"):
+        return lzma.open(filename, "rb")
+    else:
+        return open(filename, "rb")
+
+
+class StreamingFile(io.RawIOBase):
+    """A file-object which is fed blocks by a Prefetcher's reading
+    thread, and from which the consumer reads them as they come.
+    Blocks are released as soon as they have been read."""
+    def __init__(self, prefetcher):
+        io.RawIOBase.__init__(self)
+        self.prefetcher = prefetcher
+        self.blocks = collections.deque()
+        self.queued_bytes = 0
+        self.bEnd = False
+        self.bCancelled = False
+        self.error = None
+        self.hash_value = None
+
+        self.block = b""
+        self.offset = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if len(b) == 0:
+            return 0
+
+        if self.offset >= len(self.block):
+            condition = self.prefetcher.condition
+            with condition:
+                if len(self.blocks) == 0 and not self.bEnd and self.error == None:
+                    start_time = time.time()
+                    while len(self.blocks) == 0 and not self.bEnd and self.error == None:
+                        condition.wait()
+                    self.prefetcher.stall_time += time.time() - start_time
+
+                if len(self.blocks) == 0:
+                    if self.error != None:
+                        raise self.error
+                    return 0
+
+                self.block = self.blocks.popleft()
+                self.offset = 0
+                self.queued_bytes -= len(self.block)
+                self.prefetcher.buffered_bytes -= len(self.block)
+                condition.notify_all()
+
+        count = min(len(b), len(self.block) - self.offset)
+        b[:count] = self.block[self.offset:self.offset + count]
+        self.offset += count
+        return count
+
+    def getHash(self):
+        """Returns the hash of the contents of the file, waiting for
+        it if need be.  The Prefetcher must have been given a
+        hash_mode."""
+        condition = self.prefetcher.condition
+        with condition:
+            if self.hash_value == None and self.error == None:
+                start_time = time.time()
+                while self.hash_value == None and self.error == None:
+                    condition.wait()
+                self.prefetcher.stall_time += time.time() - start_time
+
+            if self.hash_value == None:
+                raise self.error
+            return self.hash_value
+
+    def close(self):
+        with self.prefetcher.condition:
+            self.bCancelled = True
+            self.prefetcher.buffered_bytes -= self.queued_bytes
+            self.queued_bytes = 0
+            self.blocks.clear()
+            self.block = b""
+            self.prefetcher.condition.notify_all()
+        io.RawIOBase.close(self)
+
+
+class Prefetcher:
+    """Reads (and decompresses) the current input file and the next
+    few ones in background threads while the current one is being
+    parsed.
+
+    Iterating over a Prefetcher yields (filename, file-object) pairs
+    in the original order.  The file-objects are StreamingFiles,
+    which are not seekable, and which are fed fixed-size blocks, so
+    that the parser can start on a file before it has been read in
+    full.
+
+    At most max_buffered_bytes are held in memory by blocks which
+    have been read but not yet parsed, whether of the current file
+    or of the files read ahead.  The files read ahead leave room for
+    one block of the current file, so that it can always go on.
+
+    If hash_mode is given (see duplicate_index.hash_modes), each file
+    is first read once to hash it, in the same background thread,
+    and the hash is then available from the StreamingFile's
+    getHash().
+
+    stall_time is the total number of seconds the consumer has spent
+    waiting for a block which was not yet read.
+    """
+    def __init__(self, filename_list, read_ahead = default_read_ahead, max_buffered_bytes = default_max_buffered_bytes, block_size = default_block_size, hash_mode = None):
+        assert read_ahead >= 1
+        assert max_buffered_bytes >= 1
+
+        self.filename_list = list(filename_list)
+        self.read_ahead = read_ahead
+        self.max_buffered_bytes = max_buffered_bytes
+        self.block_size = min(block_size, max_buffered_bytes)
+        self.hash_mode = hash_mode
+
+        self.condition = threading.Condition()
+        self.buffered_bytes = 0
+        self.current_index = 0 # Index of the file being parsed
+        self.bClosed = False
+
+        self.stall_time = 0.0
+
+        self.executor = None
+        self.readers = collections.deque()
+        self.next_submit_index = 0
+
+    def hasRoom(self, index):
+        if index == self.current_index:
+            limit = self.max_buffered_bytes
+        else:
+            limit = self.max_buffered_bytes - self.block_size
+        return self.buffered_bytes + self.block_size <= limit
+
+    def readFile(self, index, filename, reader):
+        fin = None
+        try:
+            if self.hash_mode != None:
+                if self.bClosed:
+                    return
+                hash_fin = openInputFile(filename)
+                try:
+                    hash_value = duplicate_index.hashFile(hash_fin, self.hash_mode)
+                finally:
+                    hash_fin.close()
+                with self.condition:
+                    reader.hash_value = hash_value
+                    self.condition.notify_all()
+
+            fin = openInputFile(filename)
+            while True:
+                with self.condition:
+                    while not self.bClosed \
+                          and not reader.bCancelled \
+                          and not self.hasRoom(index):
+                        self.condition.wait()
+
+                    if self.bClosed or reader.bCancelled:
+                        return
+
+                    # Reserve room for one block
+                    self.buffered_bytes += self.block_size
+
+                block = fin.read(self.block_size)
+
+                with self.condition:
+                    self.buffered_bytes -= self.block_size
+                    if not reader.bCancelled:
+                        if block:
+                            reader.blocks.append(block)
+                            reader.queued_bytes += len(block)
+                            self.buffered_bytes += len(block)
+                        else:
+                            reader.bEnd = True
+                    self.condition.notify_all()
+
+                if not block:
+                    break
+        except Exception as e:
+            with self.condition:
+                reader.error = e
+                self.condition.notify_all()
+        finally:
+            if fin != None:
+                fin.close()
+
+    def submitUpTo(self, index):
+        while self.next_submit_index < len(self.filename_list) \
+              and self.next_submit_index <= index:
+            filename = self.filename_list[self.next_submit_index]
+            reader = StreamingFile(self)
+            self.executor.submit(self.readFile, self.next_submit_index, filename, reader)
+            self.readers.append(reader)
+            self.next_submit_index += 1
+
+    def __iter__(self):
+        # One thread for the current file, and one for each file read
+        # ahead.
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers = self.read_ahead + 1)
+        try:
+            for index in range(0, len(self.filename_list)):
+                with self.condition:
+                    self.current_index = index
+                    self.condition.notify_all()
+
+                self.submitUpTo(index + self.read_ahead)
+
+                fin = self.readers.popleft()
+                try:
+                    yield (self.filename_list[index], fin)
+                finally:
+                    fin.close()
+        finally:
+            self.close()
+
+    def close(self):
+        with self.condition:
+            self.bClosed = True
+            self.condition.notify_all()
+
+        for reader in self.readers:
+            reader.close()
+        self.readers.clear()
+
+        if self.executor != None:
+            self.executor.shutdown(wait = True)
+            self.executor = None
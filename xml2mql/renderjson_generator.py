@@ -13,6 +13,8 @@
 #
 import json
 
+from . import token_features
+
 class RenderJSONGeneratorHandler:
     def __init__(self, json_file):
         self.script = json.loads(b"".join(json_file.readlines()).decode('utf-8'))
@@ -44,16 +46,17 @@ class RenderJSONGeneratorHandler:
         for elementName in sorted(self.script["handled_elements"]):
             self.handleElement(elementName)
 
+        # Tokens are rendered from those of pre, surface and post
+        # which the script gives them.
+        tokenFeatureNameList = [featureName for (featureName, featureType) in token_features.getTokenFeatureList(self.script["global_parameters"])]
+        get_list = [featureName for featureName in ["pre", "surface", "post"] if featureName in tokenFeatureNameList]
+        start_str = "".join(["{{ feature %d }}" % index for index in range(0, len(get_list))])
+
         for tokenObjectTypeName in self.script["global_parameters"]["tokenObjectTypeNameList"]:
-            get_list = [
-                "pre",
-                "surface",
-                "post"
-            ]
             obj = {
                 "docindexfeature" : self.docindex,
-                "start" : "{{ feature 0 }}{{ feature 1 }}{{ feature 2 }}",
-                "get" : get_list
+                "start" : start_str,
+                "get" : list(get_list)
             }
 
             self.render["fetchinfo"]["base"]["object_types"][tokenObjectTypeName] = obj
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#
+# XML to Emdros MQL data importer.
+#
+#
+# Copyright (C) 2018  Sandborg-Petersen Holding ApS, Denmark
+#
+# Made available under the MIT License.
+#
+# See the file LICENSE in the root of the sources for the full license
+# text.
+#
+#
+# A sidecar index, written next to the MQL, giving the monads, id_ds
+# and docindexes of each document (by basename) and, optionally, of
+# each element with an xml:id, so that they can be looked up without
+# querying Emdros.
+#
+# The file is little-endian:
+#
+#   index_magic
+#   uint32 version, uint32 entry count, uint32 string table size
+#   entry count entries (entry_struct), sorted by kind, then key,
+#     then first monad
+#   the string table, UTF-8
+#
+# Each entry is:
+#
+#   kind (KIND_*), 3 bytes of padding,
+#   key offset and length in the string table,
+#   object type name offset and length in the string table,
+#   first monad, last monad, first id_d, last id_d,
+#   first docindex, last docindex
+#
+# The id_d and docindex ranges are those of the object itself and of
+# everything inside it.  Since the entries have a fixed size and are
+# sorted, the file can be memory-mapped and searched in place (see
+# SidecarIndex).
+#
+import mmap
+import struct
+
+index_magic = b"XML2MQLIDX\n"
+index_version = 1
+
+KIND_DOCUMENT = 0 # Keyed by basename
+KIND_ELEMENT = 1 # Keyed by xml:id
+
+header_struct = struct.Struct("<III")
+entry_struct = struct.Struct("<Bxxx10I")
+
+default_id_attribute = "xml:id"
+
+class SidecarIndexWriter:
+    """Collects index entries while MQLGeneratorHandler parses, and
+    writes them sorted at the end.
+
+    indexed_object_types is the set of object types whose elements
+    are indexed by their id_attribute, if they have one.  Documents
+    are always indexed."""
+    def __init__(self, indexed_object_types = (), id_attribute = default_id_attribute):
+        self.indexed_object_types = set(indexed_object_types)
+        self.id_attribute = id_attribute
+        self.entry_list = []
+
+    def startEntry(self, kind, key, objectTypeName, first_id_d, first_docindex):
+        """Returns an entry to be passed to endEntry() when the
+        object ends."""
+        return [kind, key, objectTypeName, first_id_d, first_docindex]
+
+    def endEntry(self, entry, obj, last_id_d, last_docindex):
+        (kind, key, objectTypeName, first_id_d, first_docindex) = entry
+        self.entry_list.append((kind, key.encode('utf-8'), obj.fm, objectTypeName, obj.lm, first_id_d, last_id_d, first_docindex, last_docindex))
+
+    def write(self, fout):
+        self.entry_list.sort()
+
+        string_table = bytearray()
+        string_offsets = {} # bytes -> offset
+        def addString(s):
+            if s not in string_offsets:
+                string_offsets[s] = len(string_table)
+                string_table.extend(s)
+            return string_offsets[s]
+
+        fout.write(index_magic)
+        fout.write(header_struct.pack(index_version, len(self.entry_list), 0))
+
+        for (kind, key, fm, objectTypeName, lm, first_id_d, last_id_d, first_docindex, last_docindex) in self.entry_list:
+            objectTypeName = objectTypeName.encode('utf-8')
+            fout.write(entry_struct.pack(kind, addString(key), len(key), addString(objectTypeName), len(objectTypeName), fm, lm, first_id_d, last_id_d, first_docindex, last_docindex))
+
+        fout.write(string_table)
+
+        # Now that its size is known, fill in the string table size.
+        fout.seek(len(index_magic))
+        fout.write(header_struct.pack(index_version, len(self.entry_list), len(string_table)))
+        fout.seek(0, 2)
+
+
+class SidecarIndex:
+    """Looks up entries in a sidecar index file, memory-mapped."""
+    def __init__(self, filename):
+        self.fin = open(filename, "rb")
+        self.data = mmap.mmap(self.fin.fileno(), 0, access = mmap.ACCESS_READ)
+
+        if self.data[:len(index_magic)] != index_magic:
+            raise Exception("Error: %s is not a sidecar index file." % filename)
+
+        (version, self.entry_count, string_table_size) = header_struct.unpack_from(self.data, len(index_magic))
+        if version != index_version:
+            raise Exception("Error: Unsupported sidecar index version %d." % version)
+
+        self.entries_offset = len(index_magic) + header_struct.size
+        self.string_table_offset = self.entries_offset + self.entry_count * entry_struct.size
+
+    def close(self):
+        self.data.close()
+        self.fin.close()
+
+    def getString(self, offset, length):
+        start = self.string_table_offset + offset
+        return self.data[start:start + length]
+
+    def getSortKey(self, index):
+        entry = entry_struct.unpack_from(self.data, self.entries_offset + index * entry_struct.size)
+        return (entry[0], self.getString(entry[1], entry[2]))
+
+    def getEntry(self, index):
+        (kind, key_offset, key_length, type_offset, type_length, fm, lm, first_id_d, last_id_d, first_docindex, last_docindex) = entry_struct.unpack_from(self.data, self.entries_offset + index * entry_struct.size)
+        return {
+            "kind" : kind,
+            "key" : self.getString(key_offset, key_length).decode('utf-8'),
+            "objectTypeName" : self.getString(type_offset, type_length).decode('utf-8'),
+            "first_monad" : fm,
+            "last_monad" : lm,
+            "first_id_d" : first_id_d,
+            "last_id_d" : last_id_d,
+            "first_docindex" : first_docindex,
+            "last_docindex" : last_docindex,
+        }
+
+    def lookup(self, kind, key):
+        """Returns the entries with the given kind and key, in the
+        order of their first monads."""
+        sort_key = (kind, key.encode('utf-8'))
+
+        # Find the first entry which is not less than sort_key.
+        low = 0
+        high = self.entry_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.getSortKey(middle) < sort_key:
+                low = middle + 1
+            else:
+                high = middle
+
+        result = []
+        while low < self.entry_count and self.getSortKey(low) == sort_key:
+            result.append(self.getEntry(low))
+            low += 1
+        return result
+
+    def lookupDocument(self, basename):
+        return self.lookup(KIND_DOCUMENT, basename)
+
+    def lookupElement(self, xml_id):
+        return self.lookup(KIND_ELEMENT, xml_id)
@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+#
+# XML to Emdros MQL data importer.
+#
+#
+# Copyright (C) 2018  Sandborg-Petersen Holding ApS, Denmark
+#
+# Made available under the MIT License.
+#
+# See the file LICENSE in the root of the sources for the full license
+# text.
+#
+#
+# Parsing one big XML file in several processes at once.
+#
+# 1. The file is scanned once, to find the byte offsets of the
+#    "record" elements (the elements with a given name which are not
+#    inside another one).  Runs of records with the same parent are
+#    cut into chunks of roughly the same size.  For each chunk, the
+#    state of the handler at its start (the element stack, the nixing
+#    stack, and the document boundary stack and ordinal) is worked
+#    out from the names of the enclosing elements.
+#
+# 2. Each chunk is wrapped in a dummy root element, after the prolog
+#    of the file, and parsed by a ChunkHandler in a worker process,
+#    starting from that state and from monad 1, id_d 1 and docindex
+#    1.  The objects are sent back as an object stream (see
+#    object_stream), one object list per flush of the objects, with
+#    the object types in each list and the numbers of monads, id_ds
+#    and docindexes used.
+#
+# 3. Meanwhile, a skeleton of the file, in which each chunk has been
+#    replaced by the processing instruction <?xml2mql-chunk K?>, is
+#    parsed in this process by a SplicingHandler.  At each of these,
+#    the object stream of chunk K is handed back to a worker, to be
+#    formatted as MQL at the current monad, id_d and docindex (as by
+#    reemitMQL()), and a ChunkObjects stands in for the objects of
+#    each type until they are written.  The counters are then moved
+#    on past the chunk, and the documents started in it are counted.
+#    No objects of a chunk are made in this process.
+#
+# Since every object completed in a chunk is written, in the same
+# order, at the point where the sequential parse would have written
+# it, the output is the same as that of MQLGeneratorHandler parsing
+# the file on its own.
+#
+import io
+import os
+import collections
+import xml.sax
+import xml.parsers.expat
+
+from . import emdros_util
+from . import mql_generator
+from . import object_stream
+from . import entity_catalog
+
+chunk_pi_target = "xml2mql-chunk"
+chunk_root_element = "xml2mql-chunk"
+
+default_chunk_bytes = 16 * 1024 * 1024
+
+scan_block_size = 1024 * 1024
+
+ChunkState = collections.namedtuple("ChunkState", ["elemstack", "nixing_stack", "boundaryStack", "documentOrdinal"])
+
+class Chunk:
+    def __init__(self, start, state):
+        self.start = start
+        self.end = None
+        self.bEndsAtEndTag = None # Otherwise at the next record's start-tag
+        self.state = state
+
+
+class SplitScanner:
+    """Finds the chunks of an XML file; see the top of the file."""
+    def __init__(self, split_element, chunk_bytes, nixed_elements, documentBoundaryElement):
+        self.split_element = split_element
+        self.chunk_bytes = chunk_bytes
+        self.nixed_elements = nixed_elements
+        self.documentBoundaryElement = documentBoundaryElement
+
+        self.chunk_list = []
+        self.prolog_end = None # Offset of the start tag of the root
+
+        # The state of a MQLGeneratorHandler at this point.
+        self.elemstack = []
+        self.nixing_stack = []
+        self.boundaryStack = []
+        self.documentOrdinal = 0
+
+        # For each open element, the chunk being filled with its
+        # children, if any.  Records inside a chunk of an enclosing
+        # element do not start chunks of their own.
+        self.open_chunk_stack = []
+        self.open_chunk_count = 0
+
+    def scan(self, fin):
+        self.parser = xml.parsers.expat.ParserCreate()
+        self.parser.StartElementHandler = self.startElement
+        self.parser.EndElementHandler = self.endElement
+
+        while True:
+            block = fin.read(scan_block_size)
+            self.parser.Parse(block, len(block) == 0)
+            if len(block) == 0:
+                break
+
+        del self.parser
+
+        return self.chunk_list
+
+    def getState(self):
+        return ChunkState(list(self.elemstack), list(self.nixing_stack), list(self.boundaryStack), self.documentOrdinal)
+
+    def startElement(self, tag, attributes):
+        offset = self.parser.CurrentByteIndex
+
+        if self.prolog_end == None:
+            self.prolog_end = offset
+
+        if tag == self.split_element and len(self.elemstack) > 0 and tag not in self.elemstack:
+            chunk = self.open_chunk_stack[-1]
+            if chunk == None:
+                if self.open_chunk_count == 0:
+                    chunk = Chunk(offset, self.getState())
+                    self.open_chunk_stack[-1] = chunk
+                    self.open_chunk_count += 1
+            elif offset - chunk.start >= self.chunk_bytes:
+                chunk.end = offset
+                chunk.bEndsAtEndTag = False
+                self.chunk_list.append(chunk)
+                chunk = Chunk(offset, self.getState())
+                self.open_chunk_stack[-1] = chunk
+
+        # As in MQLGeneratorHandler.doActionsBeforeHandleElementStart()
+        # and BaseHandler.startElement().
+        if tag == self.documentBoundaryElement:
+            if len(self.nixing_stack) == 0 \
+               and tag not in self.nixed_elements \
+               and True not in self.boundaryStack:
+                self.documentOrdinal += 1
+                self.boundaryStack.append(True)
+            else:
+                self.boundaryStack.append(False)
+
+        if tag in self.nixed_elements:
+            self.nixing_stack.append(tag)
+
+        self.elemstack.append(tag)
+        self.open_chunk_stack.append(None)
+
+    def endElement(self, tag):
+        chunk = self.open_chunk_stack.pop()
+        if chunk != None:
+            chunk.end = self.parser.CurrentByteIndex
+            chunk.bEndsAtEndTag = True
+            self.chunk_list.append(chunk)
+            self.open_chunk_count -= 1
+
+        # As in BaseHandler.endElement() and
+        # MQLGeneratorHandler.doActionsAfterHandleElementEnd().
+        if len(self.nixing_stack) != 0 and self.nixing_stack[-1] == tag:
+            self.nixing_stack.pop()
+
+        if tag == self.documentBoundaryElement:
+            self.boundaryStack.pop()
+
+        self.elemstack.pop()
+
+
+class ChunkHandler(mql_generator.MQLGeneratorHandler):
+    """Parses one chunk, wrapped in chunk_root_element, starting from
+    a ChunkState, and writes the objects to an object stream.  Each
+    flush ends an object list, and the objects left at the end make
+    up the last one.  object_list_types gets the names of the object
+    types in each object list."""
+    def __init__(self, json_file, state, bEndsAtEndTag, object_stream_file):
+        mql_generator.MQLGeneratorHandler.__init__(self, json_file, None, 1, 1, 1)
+        self.state = state
+        self.bEndsAtEndTag = bEndsAtEndTag
+        self.bSchemaHasBeenDumped = True
+        self.startObjectStream(object_stream_file)
+        self.object_list_types = []
+
+    def dumpMQLObjects(self, fout):
+        self.object_list_types.append([objectTypeName for objectTypeName in sorted(self.objects) if len(self.objects[objectTypeName]) > 0])
+        mql_generator.MQLGeneratorHandler.dumpMQLObjects(self, fout)
+
+    def startDocument(self):
+        self.tokenizer.reset()
+        self.pendingTokenObjectTypeName = None
+        self.textSavePoint = None
+
+        self.elemstack = list(self.state.elemstack)
+        self.nixing_stack = list(self.state.nixing_stack)
+        self.boundaryStack = list(self.state.boundaryStack)
+        self.documentOrdinal = self.state.documentOrdinal
+
+    def endDocument(self):
+        self.dumpMQLObjects(None)
+
+    def startElement(self, tag, attributes):
+        if tag != chunk_root_element:
+            mql_generator.MQLGeneratorHandler.startElement(self, tag, attributes)
+
+    def endElement(self, tag):
+        if tag == chunk_root_element:
+            # The text after the last record ends at the next tag,
+            # which is in the skeleton.
+            self.handleChars("", tag, self.bEndsAtEndTag)
+        else:
+            mql_generator.MQLGeneratorHandler.endElement(self, tag)
+
+
+def parseChunk(script_bytes, selection, filename, basename, prolog, start, end, bEndsAtEndTag, state, catalog_directory):
+    """Parses one chunk in a worker process.  Returns the object
+    stream, the object types in each of its object lists, the
+    numbers of monads, id_ds and docindexes used, and the number of
+    documents started at documentBoundaryElements."""
+    fin = open(filename, "rb")
+    fin.seek(start)
+    data = fin.read(end - start)
+    fin.close()
+
+    object_stream_file = io.BytesIO()
+    handler = ChunkHandler(io.BytesIO(script_bytes), state, bEndsAtEndTag, object_stream_file)
+    if selection != None:
+        handler.updateSelection(selection)
+    handler.setBasename(basename)
+
+    source = io.BytesIO(prolog + b"<" + chunk_root_element.encode('ascii') + b">" + data + b"</" + chunk_root_element.encode('ascii') + b">")
+    if catalog_directory != None:
+        entity_resolver = entity_catalog.CatalogEntityResolver(catalog_directory)
+        entity_resolver.setDocumentFilename(filename)
+        entity_resolver.parse(source, handler)
+    else:
+        xml.sax.parse(source, handler)
+
+    if handler.documentBoundaryElement != None:
+        document_count = handler.documentOrdinal - state.documentOrdinal
+    else:
+        document_count = 0
+
+    return (object_stream_file.getvalue(), handler.object_list_types, handler.curmonad - 1, handler.curid_d - 1, handler.curdocindex - 1, document_count)
+
+def formatChunk(object_stream_bytes, first_monad, first_id_d, first_docindex):
+    """Formats the objects of a chunk in a worker process.  Returns,
+    for each object list, a dictionary mapping each object type name
+    to the MQL of its objects (see object_stream.formatObjectLists())."""
+    return list(object_stream.formatObjectLists(io.BytesIO(object_stream_bytes), first_monad, first_id_d, first_docindex))
+
+
+class ChunkObjects:
+    """Stands in, in an object list of a SplicingHandler, for the
+    objects of one type in one object list of a chunk, until
+    formatChunk() has formatted them."""
+    def __init__(self, future, index, objectTypeName):
+        self.future = future
+        self.index = index
+        self.objectTypeName = objectTypeName
+
+    def getFormattedObjects(self):
+        return emdros_util.FormattedObjects(self.future.result()[self.index][self.objectTypeName])
+
+
+class SplicingHandler(mql_generator.MQLGeneratorHandler):
+    """A MQLGeneratorHandler which parses the skeleton of a split
+    file, and splices in the objects of each chunk at its processing
+    instruction.  setChunkResults() must be given the results of
+    parseChunk(), and the executor to format them with, before each
+    file.  Objects cannot be saved to an object stream, since those
+    of the chunks are never made here."""
+    def setChunkResults(self, chunk_result_iterator, executor):
+        self.chunk_result_iterator = chunk_result_iterator
+        self.executor = executor
+        self.chunk_index = 0
+        self.chunk_objects_list = [] # list of (object_list, index, ChunkObjects)
+
+    def dumpMQLObjects(self, fout):
+        # Workers may still be formatting the objects, so they are
+        # only waited for here.
+        for (object_list, index, chunk_objects) in self.chunk_objects_list:
+            object_list[index] = chunk_objects.getFormattedObjects()
+        self.chunk_objects_list = []
+
+        mql_generator.MQLGeneratorHandler.dumpMQLObjects(self, fout)
+
+    def processingInstruction(self, target, data):
+        if target != chunk_pi_target:
+            return
+
+        if int(data) != self.chunk_index:
+            raise Exception("Error: Chunk %s came out of order." % data)
+        self.chunk_index += 1
+
+        # The chunk starts with a start-tag, which ends the text
+        # before it.
+        self.handleChars("", None, False)
+
+        (object_stream_bytes, object_list_types, monad_count, id_d_count, docindex_count, document_count) = next(self.chunk_result_iterator)
+
+        future = self.executor.submit(formatChunk, object_stream_bytes, self.curmonad, self.curid_d, self.curdocindex)
+        for index in range(0, len(object_list_types)):
+            if index > 0:
+                self.flushObjects()
+
+            for objectTypeName in object_list_types[index]:
+                object_list = self.objects.setdefault(objectTypeName, [])
+                self.chunk_objects_list.append((object_list, len(object_list), ChunkObjects(future, index, objectTypeName)))
+                object_list.append(self.chunk_objects_list[-1][2])
+
+        self.curmonad += monad_count
+        self.curid_d += id_d_count
+        self.curdocindex += docindex_count
+        if self.documentBoundaryElement != None:
+            self.documentOrdinal += document_count
+
+
+def scanFile(filename, split_element, chunk_bytes, script):
+    """Returns (prolog, chunk_list) for the XML file."""
+    scanner = SplitScanner(split_element, chunk_bytes, set(script["nixed_elements"]), script["global_parameters"].get("documentBoundaryElement", None))
+    fin = open(filename, "rb")
+    chunk_list = scanner.scan(fin)
+    fin.seek(0)
+    prolog = fin.read(scanner.prolog_end)
+    fin.close()
+    return (prolog, chunk_list)
+
+def makeSkeleton(filename, chunk_list):
+    """Returns the bytes of the file, with each chunk replaced by its
+    processing instruction."""
+    result = []
+    fin = open(filename, "rb")
+    position = 0
+    for index in range(0, len(chunk_list)):
+        chunk = chunk_list[index]
+        result.append(fin.read(chunk.start - position))
+        result.append(("<?%s %d?>" % (chunk_pi_target, index)).encode('ascii'))
+        fin.seek(chunk.end)
+        position = chunk.end
+    result.append(fin.read())
+    fin.close()
+    return b"".join(result)
+
+def iterateChunkResults(executor, max_in_flight, script_bytes, selection, filename, basename, prolog, chunk_list, catalog_directory):
+    """Yields the results of parseChunk() for the chunks in order,
+    with at most max_in_flight chunks submitted at a time."""
+    future_queue = collections.deque()
+    next_index = 0
+    while next_index < len(chunk_list) or len(future_queue) > 0:
+        while next_index < len(chunk_list) and len(future_queue) < max_in_flight:
+            chunk = chunk_list[next_index]
+            future_queue.append(executor.submit(parseChunk, script_bytes, selection, filename, basename, prolog, chunk.start, chunk.end, chunk.bEndsAtEndTag, chunk.state, catalog_directory))
+            next_index += 1
+        yield future_queue.popleft().result()
+
+def parseFileInChunks(handler, filename, split_element, executor, max_in_flight, script_bytes, selection = None, catalog_directory = None, chunk_bytes = default_chunk_bytes, entity_resolver = None):
+    """Parses the XML file with the SplicingHandler handler, with
+    the chunks parsed by executor (a ProcessPoolExecutor)."""
+    (prolog, chunk_list) = scanFile(filename, split_element, chunk_bytes, handler.script)
+
+    basename = os.path.split(filename)[-1]
+    handler.setBasename(basename)
+    handler.setChunkResults(iterateChunkResults(executor, max_in_flight, script_bytes, selection, filename, basename, prolog, chunk_list, catalog_directory), executor)
+
+    skeleton = io.BytesIO(makeSkeleton(filename, chunk_list))
+    if entity_resolver != None:
+        entity_resolver.setDocumentFilename(filename)
+        entity_resolver.parse(skeleton, handler)
+    else:
+        xml.sax.parse(skeleton, handler)
+
+    return len(chunk_list)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+#
+# XML to Emdros MQL data importer.
+#
+#
+# Copyright (C) 2018  Sandborg-Petersen Holding ApS, Denmark
+#
+# Made available under the MIT License.
+#
+# See the file LICENSE in the root of the sources for the full license
+# text.
+#
+#
+# Finding out which elements an import spends its time on.
+#
+# TagProfiler.install() replaces some of a handler's methods, on the
+# handler object only, with versions which time them, so that nothing
+# is slowed down unless profiling is asked for.  Per element name, it
+# counts:
+#
+# - start tags, characters() calls and the characters they brought,
+# - the time spent in characters() and handleChars(), which is where
+#   text is tokenized, counted against the element the text is in,
+# - the time spent in handleElementStart() and handleElementEnd(),
+# - the objects made (createObject()) while the element is the
+#   current one, and the time spent making them.  This time is also
+#   part of one of the times above.
+#
+import time
+import json
+
+# Positions in the per-tag statistics lists.
+STAT_STARTS = 0
+STAT_CHARACTERS_CALLS = 1
+STAT_CHARACTERS = 2
+STAT_CHARACTERS_TIME = 3
+STAT_HANDLE_CHARS_TIME = 4
+STAT_ELEMENT_START_TIME = 5
+STAT_ELEMENT_END_TIME = 6
+STAT_OBJECTS = 7
+STAT_OBJECT_TIME = 8
+
+stat_names = [
+    "starts",
+    "characters_calls",
+    "characters",
+    "characters_seconds",
+    "handle_chars_seconds",
+    "element_start_seconds",
+    "element_end_seconds",
+    "objects",
+    "object_seconds",
+]
+
+class TagProfiler:
+    def __init__(self):
+        self.stats = {} # tag -> list of stat_names values
+
+    def getStats(self, tag):
+        stats = self.stats.get(tag, None)
+        if stats == None:
+            stats = [0, 0, 0, 0.0, 0.0, 0.0, 0.0, 0, 0.0]
+            self.stats[tag] = stats
+        return stats
+
+    def install(self, handler):
+        """Makes handler (a BaseHandler) report to this profiler."""
+        perf_counter = time.perf_counter
+        getStats = self.getStats
+
+        original_startElement = handler.startElement
+        def startElement(tag, attributes):
+            getStats(tag)[STAT_STARTS] += 1
+            original_startElement(tag, attributes)
+        handler.startElement = startElement
+
+        original_characters = handler.characters
+        def characters(data):
+            start_time = perf_counter()
+            original_characters(data)
+            stats = getStats(handler.getCurElement())
+            stats[STAT_CHARACTERS_CALLS] += 1
+            stats[STAT_CHARACTERS] += len(data)
+            stats[STAT_CHARACTERS_TIME] += perf_counter() - start_time
+        handler.characters = characters
+
+        original_handleChars = handler.handleChars
+        def handleChars(chars_before, tag, bIsEndTag):
+            # The text is in the element which is ending, or in the
+            # parent of the element which is starting.
+            if bIsEndTag or len(handler.elemstack) < 2:
+                text_tag = handler.getCurElement()
+            else:
+                text_tag = handler.elemstack[-2]
+            start_time = perf_counter()
+            original_handleChars(chars_before, tag, bIsEndTag)
+            getStats(text_tag)[STAT_HANDLE_CHARS_TIME] += perf_counter() - start_time
+        handler.handleChars = handleChars
+
+        original_handleElementStart = handler.handleElementStart
+        def handleElementStart(tag, attributes):
+            start_time = perf_counter()
+            result = original_handleElementStart(tag, attributes)
+            getStats(tag)[STAT_ELEMENT_START_TIME] += perf_counter() - start_time
+            return result
+        handler.handleElementStart = handleElementStart
+
+        original_handleElementEnd = handler.handleElementEnd
+        def handleElementEnd(tag):
+            start_time = perf_counter()
+            result = original_handleElementEnd(tag)
+            getStats(tag)[STAT_ELEMENT_END_TIME] += perf_counter() - start_time
+            return result
+        handler.handleElementEnd = handleElementEnd
+
+        if hasattr(handler, "createObject"):
+            original_createObject = handler.createObject
+            def createObject(objectTypeName):
+                start_time = perf_counter()
+                result = original_createObject(objectTypeName)
+                stats = getStats(handler.getCurElement())
+                stats[STAT_OBJECTS] += 1
+                stats[STAT_OBJECT_TIME] += perf_counter() - start_time
+                return result
+            handler.createObject = createObject
+
+    def getTotalTime(self, stats):
+        return stats[STAT_CHARACTERS_TIME] + stats[STAT_HANDLE_CHARS_TIME] + stats[STAT_ELEMENT_START_TIME] + stats[STAT_ELEMENT_END_TIME]
+
+    def getSortedTags(self):
+        """Returns the tags, the most costly first."""
+        return sorted(self.stats, key = lambda tag: (-self.getTotalTime(self.stats[tag]), tag))
+
+    def getReport(self):
+        report = {}
+        for tag in self.stats:
+            stats = self.stats[tag]
+            tag_report = {}
+            for index in range(0, len(stat_names)):
+                tag_report[stat_names[index]] = stats[index]
+            tag_report["total_seconds"] = self.getTotalTime(stats)
+            report[tag] = tag_report
+        return report
+
+    def writeReport(self, fout):
+        """Writes the JSON report to the binary file fout."""
+        fout.write(json.dumps(self.getReport(), indent = 1, sort_keys = True).encode('utf-8'))
+        fout.write(b"\n")
+
+    def writeTable(self, fout, max_rows = 30):
+        """Writes a table of the most costly tags to the text file
+        fout."""
+        total_time = sum([self.getTotalTime(stats) for stats in self.stats.values()])
+
+        fout.write("%-20s %8s %6s %10s %10s %9s %9s %9s %9s %9s\n" % ("Tag", "Starts", "%", "Total s", "Chars", "Text s", "Start s", "End s", "Objects", "Object s"))
+        for tag in self.getSortedTags()[:max_rows]:
+            stats = self.stats[tag]
+            tag_time = self.getTotalTime(stats)
+            if total_time > 0:
+                percent = 100.0 * tag_time / total_time
+            else:
+                percent = 0.0
+            fout.write("%-20s %8d %6.1f %10.3f %10d %9.3f %9.3f %9.3f %9d %9.3f\n" % (
+                tag or "(none)",
+                stats[STAT_STARTS],
+                percent,
+                tag_time,
+                stats[STAT_CHARACTERS],
+                stats[STAT_CHARACTERS_TIME] + stats[STAT_HANDLE_CHARS_TIME],
+                stats[STAT_ELEMENT_START_TIME],
+                stats[STAT_ELEMENT_END_TIME],
+                stats[STAT_OBJECTS],
+                stats[STAT_OBJECT_TIME]))
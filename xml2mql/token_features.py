@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+#
+# XML to Emdros MQL data importer.
+#
+#
+# Copyright (C) 2018  Sandborg-Petersen Holding ApS, Denmark
+#
+# Made available under the MIT License.
+#
+# See the file LICENSE in the root of the sources for the full license
+# text.
+#
+#
+# The features which can be given to token objects, each derived from
+# the prefix, the surface or the suffix of the token.
+#
+# Which of them are made is set in the script's global_parameters:
+#
+#   "tokenFeatureList" : [
+#     "surface",
+#     { "featureName" : "surface_nfc_casefold", "featureType" : "STRING" }
+#   ]
+#
+# An entry is either the name of a feature in token_feature_registry,
+# or a dictionary with its featureName and the featureType to use
+# instead of the default one.  Without tokenFeatureList, tokens get
+# default_token_feature_list.
+#
+import unicodedata
+
+SOURCE_PREFIX = 0
+SOURCE_SURFACE = 1
+SOURCE_SUFFIX = 2
+
+source_names = ["prefix", "surface", "suffix"]
+
+def normalizeNFC(s):
+    return unicodedata.normalize("NFC", s)
+
+def normalizeNFKC(s):
+    return unicodedata.normalize("NFKC", s)
+
+def normalizeNFCCasefold(s):
+    return unicodedata.normalize("NFC", s.casefold())
+
+class TokenFeature:
+    """function is None for the source string as it is.  Only
+    functions which are slow compared to a dictionary lookup are
+    memoized."""
+    def __init__(self, source, function, featureType, bMemoize):
+        self.source = source
+        self.function = function
+        self.featureType = featureType
+        self.bMemoize = bMemoize
+
+token_feature_registry = {
+    "pre" : TokenFeature(SOURCE_PREFIX, None, "STRING FROM SET", False),
+    "surface" : TokenFeature(SOURCE_SURFACE, None, "STRING WITH INDEX", False),
+    "post" : TokenFeature(SOURCE_SUFFIX, None, "STRING FROM SET", False),
+    "surface_lowcase" : TokenFeature(SOURCE_SURFACE, str.lower, "STRING WITH INDEX", False),
+    "surface_casefold" : TokenFeature(SOURCE_SURFACE, str.casefold, "STRING WITH INDEX", True),
+    "surface_nfc" : TokenFeature(SOURCE_SURFACE, normalizeNFC, "STRING WITH INDEX", True),
+    "surface_nfkc" : TokenFeature(SOURCE_SURFACE, normalizeNFKC, "STRING WITH INDEX", True),
+    "surface_nfc_casefold" : TokenFeature(SOURCE_SURFACE, normalizeNFCCasefold, "STRING WITH INDEX", True),
+}
+
+default_token_feature_list = ["pre", "surface", "post", "surface_lowcase"]
+
+# Memo caches are emptied when they grow beyond this many entries.
+max_memo_size = 200000
+
+def getTokenFeatureList(global_parameters):
+    """Returns the (featureName, featureType) pairs of the token
+    features asked for in global_parameters, in order."""
+    result = []
+    for entry in global_parameters.get("tokenFeatureList", default_token_feature_list):
+        if type(entry) == type({}):
+            featureName = entry["featureName"]
+            featureType = entry.get("featureType", None)
+        else:
+            featureName = entry
+            featureType = None
+
+        if featureName not in token_feature_registry:
+            raise Exception("Error: Unknown token feature '%s' in tokenFeatureList. Known token features are: %s" % (featureName, ", ".join(sorted(token_feature_registry))))
+
+        if featureType == None:
+            featureType = token_feature_registry[featureName].featureType
+
+        result.append((featureName, featureType))
+
+    return result
+
+
+def makeMemoizedFunction(function):
+    cache = {}
+    def memoized(s):
+        try:
+            return cache[s]
+        except KeyError:
+            if len(cache) >= max_memo_size:
+                cache.clear()
+            result = function(s)
+            cache[s] = result
+            return result
+    return memoized
+
+def compileTokenFeatures(featureName_list):
+    """Returns a list of (featureName, source, function) triples,
+    for making the given features.  The memo caches are shared by
+    all features with the same function."""
+    memoized_functions = {} # function -> memoized function
+    result = []
+    for featureName in featureName_list:
+        token_feature = token_feature_registry[featureName]
+        function = token_feature.function
+        if function != None and token_feature.bMemoize:
+            if function not in memoized_functions:
+                memoized_functions[function] = makeMemoizedFunction(function)
+            function = memoized_functions[function]
+        result.append((featureName, token_feature.source, function))
+    return result
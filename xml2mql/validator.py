@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+#
+# XML to Emdros MQL data importer.
+#
+#
+# Copyright (C) 2018  Sandborg-Petersen Holding ApS, Denmark
+#
+# Made available under the MIT License.
+#
+# See the file LICENSE in the root of the sources for the full license
+# text.
+#
+#
+# Checking XML files against a JSON script before importing them.
+#
+# Each file is read with a bare expat parser, with no tokenizing and
+# no objects, and every problem which would make generateMQL() fail,
+# or write bad MQL, is reported with its line and column:
+#
+# - files which are not well-formed (this stops the file),
+# - files which cannot be opened, read or decompressed (this stops
+#   the file, and is reported at line 0, column 0),
+# - start-tags which are neither handled, ignored nor nixed, outside
+#   of nixed elements (as in BaseHandler.startElement()),
+# - values of attributes with a non-STRING featureType, which are
+#   written into the MQL as they are, which are not valid for that
+#   type.  Enumeration constants are not in the script, so only the
+#   syntax of enumeration values is checked.
+#
+# With an entity catalog, external entities are read from it, and the
+# problems in them are reported at the entity reference.
+#
+import os
+import re
+import json
+import lzma
+import zlib
+import concurrent.futures
+import xml.parsers.expat
+
+from . import prefetch
+from . import entity_catalog
+
+read_block_size = 1024 * 1024
+
+# What opening, reading or decompressing an input file may raise.
+read_errors = (OSError, EOFError, lzma.LZMAError, zlib.error)
+
+integer_pattern = r"-?[0-9]+"
+id_d_pattern = r"(?:-?[0-9]+|NIL)"
+identifier_pattern = r"[A-Za-z_][A-Za-z0-9_]*"
+monad_range_pattern = r"[0-9]+(?:\s*-\s*[0-9]+)?"
+
+def makeListPattern(element_pattern, start = r"\(", end = r"\)"):
+    return start + r"\s*(?:" + element_pattern + r"(?:\s*,\s*" + element_pattern + r")*)?\s*" + end
+
+def getValuePattern(featureType):
+    """Returns the regular expression which a value of featureType
+    must match, or None if any value will do (string types)."""
+    if "string" in featureType.lower():
+        return None
+
+    # Leave out "WITH INDEX", "FROM SET" and "DEFAULT ...".
+    baseType = " ".join(featureType.upper().split())
+    baseType = baseType.split(" DEFAULT ")[0]
+    baseType = baseType.replace(" WITH INDEX", "").replace(" FROM SET", "")
+
+    if baseType == "INTEGER":
+        return integer_pattern
+    elif baseType == "ID_D":
+        return id_d_pattern
+    elif baseType == "LIST OF INTEGER":
+        return makeListPattern(integer_pattern)
+    elif baseType == "LIST OF ID_D":
+        return makeListPattern(id_d_pattern)
+    elif baseType == "SET OF MONADS":
+        return makeListPattern(monad_range_pattern, r"\{", r"\}")
+    elif baseType.startswith("LIST OF "):
+        return makeListPattern(identifier_pattern)
+    else:
+        # An enumeration
+        return identifier_pattern
+
+
+class ValidationScanner:
+    """Checks XML files against a script (a dictionary read from a
+    JSON script); see the top of the file."""
+    def __init__(self, script, entity_resolver = None):
+        self.handled_elements = set(script["handled_elements"])
+        self.ignored_elements = set(script["ignored_elements"])
+        self.nixed_elements = set(script["nixed_elements"])
+        self.entity_resolver = entity_resolver
+
+        # tag -> list of (attribute, featureType, compiled regex)
+        self.attribute_checks = {}
+        for tag in script["handled_elements"]:
+            attribute_list = []
+            for (attribute, description) in script["handled_elements"][tag].get("attributes", {}).items():
+                featureType = description.get("featureType", "STRING")
+                pattern = getValuePattern(featureType)
+                if pattern != None:
+                    attribute_list.append((attribute, featureType, re.compile(pattern + r"\Z")))
+            if len(attribute_list) > 0:
+                self.attribute_checks[tag] = attribute_list
+
+    def validate(self, filename, fin):
+        """Returns the list of (line, column, message) problems in
+        the XML file fin."""
+        self.problem_list = []
+        self.nixing_depth = 0
+
+        self.parser = xml.parsers.expat.ParserCreate()
+        self.parser.StartElementHandler = self.startElement
+        self.parser.EndElementHandler = self.endElement
+        if self.entity_resolver != None:
+            self.entity_resolver.setDocumentFilename(filename)
+            self.parser.SetParamEntityParsing(xml.parsers.expat.XML_PARAM_ENTITY_PARSING_UNLESS_STANDALONE)
+            self.parser.ExternalEntityRefHandler = self.externalEntityRef
+
+        try:
+            while True:
+                block = fin.read(read_block_size)
+                self.parser.Parse(block, len(block) == 0)
+                if len(block) == 0:
+                    break
+        except xml.parsers.expat.ExpatError as e:
+            self.problem_list.append((e.lineno, e.offset + 1, "Not well-formed: %s" % xml.parsers.expat.ErrorString(e.code)))
+        except read_errors as e:
+            self.problem_list.append((0, 0, "Cannot read the file: %s" % e))
+
+        del self.parser
+
+        return self.problem_list
+
+    def addProblem(self, message):
+        self.problem_list.append((self.parser.CurrentLineNumber, self.parser.CurrentColumnNumber + 1, message))
+
+    def externalEntityRef(self, context, base, systemId, publicId):
+        try:
+            source = self.entity_resolver.resolveEntity(publicId, systemId)
+        except Exception as e:
+            self.addProblem(str(e))
+            return 1
+        entity_parser = self.parser.ExternalEntityParserCreate(context)
+        entity_parser.ParseFile(source.getByteStream())
+        return 1
+
+    def startElement(self, tag, attributes):
+        if self.nixing_depth > 0:
+            self.nixing_depth += 1
+        elif tag in self.nixed_elements:
+            self.nixing_depth = 1
+        elif tag in self.handled_elements:
+            for (attribute, featureType, regex) in self.attribute_checks.get(tag, []):
+                if attribute in attributes and regex.match(attributes[attribute]) == None:
+                    self.addProblem("Attribute '%s' of <%s> has the value '%s', which is not a valid %s" % (attribute, tag, attributes[attribute], featureType))
+        elif tag not in self.ignored_elements:
+            self.addProblem("Unknown start-tag '<%s>'" % tag)
+
+    def endElement(self, tag):
+        if self.nixing_depth > 0:
+            self.nixing_depth -= 1
+
+
+def validateFile(script_bytes, filename, catalog_directory = None):
+    """Returns the problems in one XML file, as from
+    ValidationScanner.validate().  Runs in a worker process."""
+    if catalog_directory != None:
+        entity_resolver = entity_catalog.CatalogEntityResolver(catalog_directory)
+    else:
+        entity_resolver = None
+    scanner = ValidationScanner(json.loads(script_bytes.decode('utf-8')), entity_resolver)
+
+    try:
+        fin = prefetch.openInputFile(filename)
+    except read_errors as e:
+        return [(0, 0, "Cannot open the file: %s" % e)]
+    problem_list = scanner.validate(filename, fin)
+    fin.close()
+    return problem_list
+
+def iterateValidationResults(script_bytes, xml_filenames_list, worker_count = None, catalog_directory = None):
+    """Yields (filename, problem_list) for each XML file, in order,
+    with up to worker_count files checked at once."""
+    if worker_count == None:
+        worker_count = os.cpu_count() or 1
+
+    if worker_count <= 1:
+        for filename in xml_filenames_list:
+            yield (filename, validateFile(script_bytes, filename, catalog_directory))
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(worker_count)
+        result_iterator = executor.map(validateFile, [script_bytes] * len(xml_filenames_list), xml_filenames_list, [catalog_directory] * len(xml_filenames_list))
+        for filename in xml_filenames_list:
+            yield (filename, next(result_iterator))
+        executor.shutdown()
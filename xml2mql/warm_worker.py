@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#
+# XML to Emdros MQL data importer.
+#
+#
+# Copyright (C) 2018  Sandborg-Petersen Holding ApS, Denmark
+#
+# Made available under the MIT License.
+#
+# See the file LICENSE in the root of the sources for the full license
+# text.
+#
+#
+# A long-running worker which reads the JSON script once, and then
+# generates MQL for one job after the other, so that small jobs do
+# not pay for interpreter startup, imports, reading the script and
+# building the schema each time.
+#
+# Jobs are JSON objects, one per line, read from stdin or from the
+# connections to a Unix socket:
+#
+# {
+#   "id" : "anything",        (optional; echoed in the reply)
+#   "files" : ["a.xml", ...],
+#   "output" : "a.mql",       (the MQL file to write)
+#   "first_monad" : 1,        (optional)
+#   "first_id_d" : 1,         (optional)
+#   "first_docindex" : 1,     (optional; default: 1)
+#   "schema" : true           (optional; default: true)
+# }
+#
+# If first_monad and first_id_d are left out, the job carries on
+# from where the last successful job stopped (monads, id_ds and
+# docindexes), as if the files had been given to the same mql run.
+#
+# For each job, one JSON object is written back on a line of its
+# own: the ranges used (see import_plan.makeRange()) and "status"
+# : "ok", or "status" : "error" and the "error".
+#
+import os
+import io
+import sys
+import stat
+import json
+import time
+import socketserver
+
+from . import mql_generator
+from . import entity_catalog
+from . import import_plan
+from . import xml2mql
+
+class WarmWorker:
+    def __init__(self, json_file, first_monad = 1, first_id_d = 1, selection = None, catalog_directory = None):
+        self.handler = mql_generator.MQLGeneratorHandler(json_file, None, first_monad, first_id_d)
+        if selection != None:
+            self.handler.updateSelection(selection)
+
+        fout = io.StringIO()
+        self.handler.dumpMQLHeader(fout)
+        self.handler.dumpMQLSchema(fout)
+        self.schema_text = fout.getvalue()
+
+        if catalog_directory != None:
+            self.entity_resolver = entity_catalog.CatalogEntityResolver(catalog_directory)
+        else:
+            self.entity_resolver = None
+
+        # Where the next job carries on, if it does not say where
+        # to start.
+        self.next_list = [first_monad, first_id_d, 1]
+
+        self.job_count = 0
+
+    def checkJob(self, job):
+        """Raises an Exception if the job is not one which runJob()
+        can run."""
+        if type(job) != type({}):
+            raise Exception("Error: A job must be a JSON object.")
+
+        for key in ["files", "output"]:
+            if key not in job:
+                raise Exception("Error: The job has no \"%s\"." % key)
+
+        if type(job["files"]) != type([]):
+            raise Exception("Error: \"files\" must be a list of filenames.")
+
+        if ("first_monad" in job) != ("first_id_d" in job):
+            raise Exception("Error: first_monad and first_id_d must be given together.")
+
+    def runJob(self, job):
+        """Runs one job, and returns the reply."""
+        start_time = time.time()
+        try:
+            self.checkJob(job)
+
+            if "first_monad" in job or "first_id_d" in job:
+                first_list = [job["first_monad"], job["first_id_d"], job.get("first_docindex", 1)]
+            else:
+                first_list = list(self.next_list)
+
+            fout = open(job["output"], "w", encoding='utf-8')
+            try:
+                self.handler.restart(fout, first_list[0], first_list[1], first_list[2])
+
+                if job.get("schema", True) and len(job["files"]) > 0:
+                    fout.write(self.schema_text)
+                self.handler.bSchemaHasBeenDumped = True
+
+                for filename in xml2mql.parseXMLFiles(self.handler, job["files"], entity_resolver = self.entity_resolver):
+                    pass
+            finally:
+                fout.close()
+                self.handler.mql_file = None
+
+            self.next_list = [self.handler.curmonad, self.handler.curid_d, self.handler.curdocindex]
+
+            reply = import_plan.makeRange(first_list, self.next_list)
+            reply["status"] = "ok"
+        except Exception as e:
+            reply = {
+                "status" : "error",
+                "error" : str(e),
+            }
+
+        if type(job) == type({}) and "id" in job:
+            reply["id"] = job["id"]
+        reply["seconds"] = time.time() - start_time
+
+        self.job_count += 1
+
+        return reply
+
+    def serveLines(self, fin, fout):
+        """Runs the jobs read from the text file fin, writing the
+        replies to the text file fout, until fin ends."""
+        for line in fin:
+            if line.strip() == "":
+                continue
+
+            try:
+                job = json.loads(line)
+            except ValueError as e:
+                reply = {
+                    "status" : "error",
+                    "error" : "Error: Job is not valid JSON: %s" % e,
+                }
+            else:
+                reply = self.runJob(job)
+
+            fout.write(json.dumps(reply, sort_keys = True) + "\n")
+            fout.flush()
+
+    def serveSocket(self, socket_path):
+        """Runs the jobs sent to the Unix socket socket_path, one
+        connection at a time, until interrupted."""
+        if os.path.exists(socket_path):
+            if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                raise Exception("Error: %s exists, and is not a socket." % socket_path)
+            os.unlink(socket_path)
+
+        worker = self
+
+        class JobRequestHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                fin = io.TextIOWrapper(self.rfile, encoding='utf-8')
+                fout = io.TextIOWrapper(self.wfile, encoding='utf-8')
+                worker.serveLines(fin, fout)
+
+        server = socketserver.UnixStreamServer(socket_path, JobRequestHandler)
+        sys.stderr.write("Now serving jobs on: %s ...\n" % socket_path)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.unlink(socket_path)
@@ -13,13 +13,28 @@
 #
 import sys
 import os
+import io
 import re
 import json
+import shutil
+import tempfile
+import concurrent.futures
 import xml.sax
 
 from . import json_generator
 from . import mql_generator
 from . import renderjson_generator
+from . import prefetch
+from . import count_generator
+from . import import_plan
+from . import object_stream
+from . import entity_catalog
+from . import duplicate_index
+from . import fan_out_handler
+from . import split_parse
+from . import sidecar_index
+from . import tag_profiler
+from . import validator
 
 def getBasename(pathname):
     basename = os.path.split(pathname)[-1]
@@ -32,14 +47,30 @@ def mangle_XML_entities(s):
     r = r.replace("\"", "&quot;")
     return r
 
-def generateJSON(json_filename_or_file, xml_filename_list, default_document_name = "document", default_token_name = "token"):
+def iterateXMLFiles(xml_filename_list, read_ahead = 0, max_prefetch_bytes = prefetch.default_max_buffered_bytes, hash_mode = None):
+    """Yields (filename, file-object) pairs for the XML files in
+    order.  If read_ahead > 0, the next read_ahead files are read in
+    the background while the current one is being handled, and are
+    hashed there first if hash_mode is given (see prefetch)."""
+    if read_ahead > 0:
+        prefetcher = prefetch.Prefetcher(xml_filename_list, read_ahead, max_prefetch_bytes, hash_mode = hash_mode)
+        for (filename, fin) in prefetcher:
+            yield (filename, fin)
+
+        sys.stderr.write("Prefetch stall time: %.3f seconds\n" % prefetcher.stall_time)
+    else:
+        for filename in xml_filename_list:
+            fin = prefetch.openInputFile(filename)
+            try:
+                yield (filename, fin)
+            finally:
+                fin.close()
+
+def generateJSON(json_filename_or_file, xml_filename_list, default_document_name = "document", default_token_name = "token", read_ahead = 0, max_prefetch_bytes = prefetch.default_max_buffered_bytes, catalog_directory = None):
     handler = json_generator.JSONGeneratorHandler(default_document_name, default_token_name)
 
-    for filename in xml_filename_list:
-        fin = open(filename, "rb")
-        sys.stderr.write("Now reading: %s ...\n" % filename)
-        xml.sax.parse(fin, handler)
-        fin.close()
+    for filename in parseXMLFiles(handler, xml_filename_list, read_ahead, max_prefetch_bytes, catalog_directory):
+        pass
 
     if type(json_filename_or_file) == type(""):
         sys.stderr.write("Now writing: %s ...\n" % json_filename_or_file)
@@ -70,25 +101,411 @@ def generateRenderJSON(json_filename_or_file, render_json_filename):
     sys.stderr.write("... Done!\n")
 
     
-def generateMQL(json_filename, xml_filenames_list, first_monad, first_id_d, defualt_document_name = "document", default_token_name = "token"):
+def openJSONScript(json_filename, xml_filenames_list, default_document_name = "document", default_token_name = "token", catalog_directory = None):
     if json_filename == None or json_filename == "":
         json_file = tempfile.NamedTemporaryFile()
 
         # Generate JSON first...
-        generateJSON(json_file, xml_filenames_list, default_document_name, default_token_name)
+        generateJSON(json_file, xml_filenames_list, default_document_name, default_token_name, catalog_directory = catalog_directory)
 
         # Rewind file
         json_file.seek(0)
     else:
         json_file = open(json_filename, "rb")
 
-    handler = mql_generator.MQLGeneratorHandler(json_file, sys.stdout, first_monad, first_id_d)
+    return json_file
+
+def parseXMLFiles(handler, xml_filenames_list, read_ahead = 0, max_prefetch_bytes = prefetch.default_max_buffered_bytes, catalog_directory = None, entity_resolver = None, dup_index = None):
+    """Parses the XML files one by one with handler, yielding each
+    filename after it has been parsed.  If catalog_directory is
+    given, DTDs and external entities are read from there (see
+    entity_catalog), and never from the network.  An existing
+    entity_resolver can be given instead, to keep its cache.
+
+    If dup_index (a duplicate_index.DuplicateIndex) is given, files
+    whose contents are already in it are skipped."""
+    if entity_resolver == None and catalog_directory != None:
+        entity_resolver = entity_catalog.CatalogEntityResolver(catalog_directory)
+
+    if dup_index != None:
+        hash_mode = dup_index.mode
+    else:
+        hash_mode = None
+
+    for (filename, fin) in iterateXMLFiles(xml_filenames_list, read_ahead, max_prefetch_bytes, hash_mode):
+        if dup_index != None:
+            if fin.seekable():
+                original_filename = dup_index.checkFile(filename, fin)
+            else:
+                # Prefetched files are streamed, and cannot be
+                # rewound after hashing, so the Prefetcher hashes
+                # them in the background before streaming them.
+                original_filename = dup_index.checkHash(filename, fin.getHash())
+            if original_filename != None:
+                sys.stderr.write("Skipping: %s (a copy of %s)\n" % (filename, original_filename))
+                continue
+
+        sys.stderr.write("Now reading: %s ...\n" % filename)
+        handler.setBasename(getBasename(filename))
+        if entity_resolver != None:
+            entity_resolver.setDocumentFilename(filename)
+            entity_resolver.parse(fin, handler)
+        else:
+            xml.sax.parse(fin, handler)
+        yield filename
+
+    if entity_resolver != None:
+        entity_resolver.reportStatistics(sys.stderr)
+    if dup_index != None:
+        dup_index.reportStatistics(sys.stderr)
+
+def generateMQL(json_filename, xml_filenames_list, first_monad, first_id_d, default_document_name = "document", default_token_name = "token", read_ahead = 0, max_prefetch_bytes = prefetch.default_max_buffered_bytes, writer_mode = None, max_documents_in_flight = 2, selection = None, object_stream_filename = None, catalog_directory = None, fout = None, dedup_mode = None, dedup_index_filename = None, extra_output_list = None, index_filename = None, index_object_types = None, profile_filename = None):
+    """Writes the MQL to fout, or to stdout if fout is None.  fout
+    can also be an emdros_sink.EmdrosSink, to load the MQL straight
+    into an Emdros database.
+
+    writer_mode can be None (write each document when it ends),
+    "thread" (write in a background thread) or "process" (format
+    the MQL in worker processes).
+
+    selection can be a dictionary of object types and features to
+    include or exclude; see MQLGeneratorHandler.updateSelection().
+
+    If object_stream_filename is given, the objects are also saved
+    to that file, from which reemitMQL() can write the MQL again.
+
+    If dedup_mode is given ("raw" or "canonical"; see
+    duplicate_index), files which are copies of earlier files are
+    skipped.  If dedup_index_filename is also given, the hashes are
+    kept in that file, so that files imported in earlier runs are
+    skipped as well, and copies are recorded there as aliases.
+
+    extra_output_list can be a list of (json_filename, fout) pairs
+    of further scripts, whose MQL is written to their fout from the
+    same parse of the XML files (see fan_out_handler).
+
+    If index_filename is given, a sidecar index (see sidecar_index)
+    of the documents, and of the elements with an xml:id of the
+    object types in index_object_types, is written to it.
+
+    If profile_filename is given, the time spent on each element is
+    measured (see tag_profiler).  A table of the most costly elements
+    is written to stderr, and the full report, as JSON, to
+    profile_filename."""
+    json_file = openJSONScript(json_filename, xml_filenames_list, default_document_name, default_token_name, catalog_directory)
+
+    if fout == None:
+        fout = sys.stdout
+
+    handler = mql_generator.MQLGeneratorHandler(json_file, fout, first_monad, first_id_d)
 
     json_file.close()
+
+    if selection != None:
+        handler.updateSelection(selection)
+
+    if object_stream_filename != None:
+        object_stream_file = open(object_stream_filename, "wb")
+        handler.startObjectStream(object_stream_file)
+
+    if index_filename != None:
+        for objectTypeName in index_object_types or []:
+            if objectTypeName not in handler.schema:
+                raise Exception("Error: Unknown object type '%s' in the object types to index." % objectTypeName)
+        index_writer = sidecar_index.SidecarIndexWriter(index_object_types or [])
+        handler.startSidecarIndex(index_writer)
+
+    if profile_filename != None:
+        profiler = tag_profiler.TagProfiler()
+        handler.startProfiling(profiler)
+
+    handler_list = [handler]
+    if extra_output_list != None:
+        for (extra_json_filename, extra_fout) in extra_output_list:
+            extra_json_file = open(extra_json_filename, "rb")
+            handler_list.append(mql_generator.MQLGeneratorHandler(extra_json_file, extra_fout, first_monad, first_id_d))
+            extra_json_file.close()
+
+    if writer_mode != None:
+        for h in handler_list:
+            h.startBackgroundWriter(max_documents_in_flight, writer_mode == "process")
+
+    if len(handler_list) > 1:
+        parse_handler = fan_out_handler.FanOutHandler(handler_list)
+    else:
+        parse_handler = handler
+
+    if dedup_mode != None:
+        dup_index = duplicate_index.DuplicateIndex(dedup_mode, dedup_index_filename)
+    else:
+        dup_index = None
     
+    for filename in parseXMLFiles(parse_handler, xml_filenames_list, read_ahead, max_prefetch_bytes, catalog_directory, dup_index = dup_index):
+        pass
+
+    for h in handler_list:
+        h.finishOutput()
+
+    if object_stream_filename != None:
+        object_stream_file.close()
+
+    if dup_index != None:
+        dup_index.save()
+
+    if index_filename != None:
+        sys.stderr.write("Now writing: %s ...\n" % index_filename)
+        index_file = open(index_filename, "wb")
+        index_writer.write(index_file)
+        index_file.close()
+
+    if profile_filename != None:
+        profiler.writeTable(sys.stderr)
+        sys.stderr.write("Now writing: %s ...\n" % profile_filename)
+        profile_file = open(profile_filename, "wb")
+        profiler.writeReport(profile_file)
+        profile_file.close()
+
+
+def generateSplitMQL(json_filename, xml_filenames_list, first_monad, first_id_d, split_element, worker_count = None, chunk_bytes = split_parse.default_chunk_bytes, writer_mode = None, max_documents_in_flight = 2, selection = None, catalog_directory = None, fout = None, dedup_mode = None, dedup_index_filename = None, default_document_name = "document", default_token_name = "token"):
+    """Like generateMQL(), but each XML file is split into chunks at
+    the split_element elements, which are parsed in worker_count
+    processes at once (see split_parse).  The MQL is the same as
+    that of generateMQL().  The files must not be compressed, and
+    the objects cannot be saved to an object stream."""
     for filename in xml_filenames_list:
-        fin = open(filename, "rb")
+        if filename.lower().endswith((".gz", ".bz2", ".xz")):
+            raise Exception("Error: %s is compressed, and so cannot be split into chunks." % filename)
+
+    if fout == None:
+        fout = sys.stdout
+
+    json_file = openJSONScript(json_filename, xml_filenames_list, default_document_name, default_token_name, catalog_directory)
+    script_bytes = json_file.read()
+    json_file.close()
+
+    handler = split_parse.SplicingHandler(io.BytesIO(script_bytes), fout, first_monad, first_id_d)
+
+    if selection != None:
+        handler.updateSelection(selection)
+
+    if writer_mode != None:
+        handler.startBackgroundWriter(max_documents_in_flight, writer_mode == "process")
+
+    if catalog_directory != None:
+        entity_resolver = entity_catalog.CatalogEntityResolver(catalog_directory)
+    else:
+        entity_resolver = None
+
+    if dedup_mode != None:
+        dup_index = duplicate_index.DuplicateIndex(dedup_mode, dedup_index_filename)
+    else:
+        dup_index = None
+
+    if worker_count == None:
+        worker_count = os.cpu_count() or 1
+
+    executor = concurrent.futures.ProcessPoolExecutor(worker_count)
+    max_chunks_in_flight = 2 * worker_count
+
+    try:
+        for filename in xml_filenames_list:
+            if dup_index != None:
+                fin = open(filename, "rb")
+                original_filename = dup_index.checkFile(filename, fin)
+                fin.close()
+                if original_filename != None:
+                    sys.stderr.write("Skipping: %s (a copy of %s)\n" % (filename, original_filename))
+                    continue
+
+            sys.stderr.write("Now reading: %s ...\n" % filename)
+            chunk_count = split_parse.parseFileInChunks(handler, filename, split_element, executor, max_chunks_in_flight, script_bytes, selection, catalog_directory, chunk_bytes, entity_resolver)
+            sys.stderr.write("... %d chunks\n" % chunk_count)
+    finally:
+        executor.shutdown()
+
+    handler.finishOutput()
+
+    if dup_index != None:
+        dup_index.reportStatistics(sys.stderr)
+        dup_index.save()
+
+
+def reemitMQL(object_stream_filename, first_monad = None, first_id_d = None, fout = None, first_docindex = None):
+    """Writes the MQL saved in an object stream file by
+    generateMQL() to fout (default: stdout), starting at first_monad,
+    first_id_d and first_docindex if they are given."""
+    if fout == None:
+        fout = sys.stdout
+
+    fin = open(object_stream_filename, "rb")
+    sys.stderr.write("Now reading: %s ...\n" % object_stream_filename)
+    object_count = object_stream.reemitMQL(fin, fout, first_monad, first_id_d, first_docindex)
+    fin.close()
+    sys.stderr.write("... Done! (%d objects)\n\n" % object_count)
+
+
+def generatePlan(json_filename, xml_filenames_list, plan_filename, shard_count, first_monad, first_id_d, default_document_name = "document", default_token_name = "token", read_ahead = 0, max_prefetch_bytes = prefetch.default_max_buffered_bytes, catalog_directory = None):
+    json_file = openJSONScript(json_filename, xml_filenames_list, default_document_name, default_token_name, catalog_directory)
+
+    handler = count_generator.CountingHandler(json_file, first_monad, first_id_d)
+
+    json_file.close()
+
+    file_entry_list = []
+    first_list = [handler.curmonad, handler.curid_d, handler.curdocindex]
+    for filename in parseXMLFiles(handler, xml_filenames_list, read_ahead, max_prefetch_bytes, catalog_directory):
+        next_list = [handler.curmonad, handler.curid_d, handler.curdocindex]
+        entry = import_plan.makeRange(first_list, next_list)
+        entry["filename"] = filename
+        file_entry_list.append(entry)
+        first_list = next_list
+
+    plan = {
+        "shards" : import_plan.makeShards(file_entry_list, shard_count),
+    }
+
+    sys.stderr.write("Now writing: %s ...\n" % plan_filename)
+    import_plan.writePlan(plan, plan_filename)
+    sys.stderr.write("... Done!\n\n")
+
+
+def generateCounts(json_filename, xml_filenames_list, fout, first_monad, first_id_d, default_document_name = "document", default_token_name = "token", read_ahead = 0, max_prefetch_bytes = prefetch.default_max_buffered_bytes, selection = None, catalog_directory = None):
+    """Writes a JSON report to fout of the monads, id_ds, tokens and
+    objects per object type that generateMQL() would produce, per
+    file and in total, along with the approximate size of the MQL."""
+    json_file = openJSONScript(json_filename, xml_filenames_list, default_document_name, default_token_name, catalog_directory)
+
+    handler = count_generator.CountingHandler(json_file, first_monad, first_id_d)
+
+    json_file.close()
+
+    if selection != None:
+        handler.updateSelection(selection)
+
+    file_counts_list = []
+    total_counts = {
+        "files" : 0,
+        "monads" : 0,
+        "id_ds" : 0,
+        "tokens" : 0,
+        "objects" : {},
+        "estimated_mql_bytes" : handler.schema_size,
+    }
+    for filename in parseXMLFiles(handler, xml_filenames_list, read_ahead, max_prefetch_bytes, catalog_directory):
+        counts = handler.getFileCounts()
+        counts["filename"] = filename
+        file_counts_list.append(counts)
+
+        total_counts["files"] += 1
+        for key in ["monads", "id_ds", "tokens", "estimated_mql_bytes"]:
+            total_counts[key] += counts[key]
+        for objectTypeName in counts["objects"]:
+            total_counts["objects"][objectTypeName] = total_counts["objects"].get(objectTypeName, 0) + counts["objects"][objectTypeName]
+
+    report = {
+        "files" : file_counts_list,
+        "total" : total_counts,
+    }
+
+    fout.write(json.dumps(report, indent = 1, sort_keys = True).encode('utf-8'))
+    fout.write(b"\n")
+
+
+def validateXML(json_filename, xml_filenames_list, fout, worker_count = None, catalog_directory = None):
+    """Checks the XML files against the JSON script, worker_count
+    files at a time (see validator), and writes each problem to fout
+    as filename:line:column: message.  Returns the number of
+    problems."""
+    json_file = open(json_filename, "rb")
+    script_bytes = json_file.read()
+    json_file.close()
+
+    problem_count = 0
+    problem_file_count = 0
+    for (filename, problem_list) in validator.iterateValidationResults(script_bytes, xml_filenames_list, worker_count, catalog_directory):
         sys.stderr.write("Now reading: %s ...\n" % filename)
-        handler.setBasename(getBasename(filename))
-        xml.sax.parse(fin, handler)
+        for (line, column, message) in problem_list:
+            fout.write("%s:%d:%d: %s\n" % (filename, line, column, message))
+        problem_count += len(problem_list)
+        if len(problem_list) > 0:
+            problem_file_count += 1
+
+    sys.stderr.write("Validated %d files: %d problems in %d files.\n" % (len(xml_filenames_list), problem_count, problem_file_count))
+    return problem_count
+
+def generateShardMQL(json_filename, plan_filename, shard_index, read_ahead = 0, max_prefetch_bytes = prefetch.default_max_buffered_bytes, writer_mode = None, max_documents_in_flight = 2, selection = None, catalog_directory = None, fout = None):
+    """Generates the MQL for one shard of an import plan, writing it
+    to fout (stdout if None; see generateMQL()).  Only shard 0
+    includes the schema.  A trailer with the ranges actually used is
+    written at the end, and an Exception is raised if they differ
+    from the plan."""
+    plan = import_plan.loadPlan(plan_filename)
+    if shard_index < 0 or shard_index >= len(plan["shards"]):
+        raise Exception("Error: The plan %s has no shard %d. Its shards are numbered from 0 to %d." % (plan_filename, shard_index, len(plan["shards"]) - 1))
+    shard = plan["shards"][shard_index]
+    xml_filenames_list = [entry["filename"] for entry in shard["files"]]
+
+    json_file = openJSONScript(json_filename, xml_filenames_list, catalog_directory = catalog_directory)
+
+    if fout == None:
+        fout = sys.stdout
+
+    handler = mql_generator.MQLGeneratorHandler(json_file, fout, shard["first_monad"], shard["first_id_d"], shard["first_docindex"])
+
+    json_file.close()
+
+    if selection != None:
+        handler.updateSelection(selection)
+
+    if shard_index != 0:
+        handler.bSchemaHasBeenDumped = True
+
+    if writer_mode != None:
+        handler.startBackgroundWriter(max_documents_in_flight, writer_mode == "process")
+
+    for filename in parseXMLFiles(handler, xml_filenames_list, read_ahead, max_prefetch_bytes, catalog_directory):
+        pass
+
+    handler.finishOutput()
+
+    shard_range = import_plan.makeRange(import_plan.getFirstList(shard), [handler.curmonad, handler.curid_d, handler.curdocindex])
+    if shard_range != import_plan.makeRange(import_plan.getFirstList(shard), import_plan.getNextList(shard)):
+        raise Exception("Error: Shard %d did not produce the ranges in the plan %s. Have the XML files or the JSON script changed?" % (shard_index, plan_filename))
+
+    shard_range["shard"] = shard_index
+    fout.write(import_plan.makeShardTrailer(shard_range))
+
+
+def mergeShards(plan_filename, mql_filenames_list, fout):
+    """Checks that the MQL files are the finished outputs of all the
+    shards of the plan, with ranges that neither overlap nor leave
+    gaps, and writes them to fout in shard order."""
+    plan = import_plan.loadPlan(plan_filename)
+
+    shard2filename = {}
+    for filename in mql_filenames_list:
+        shard_range = import_plan.readShardTrailer(filename)
+        if shard_range == None:
+            raise Exception("Error: %s is not the output of a finished shard." % filename)
+        elif shard_range["shard"] in shard2filename:
+            raise Exception("Error: Shard %d is in both %s and %s." % (shard_range["shard"], shard2filename[shard_range["shard"]], filename))
+        elif shard_range["shard"] < 0 or shard_range["shard"] >= len(plan["shards"]):
+            raise Exception("Error: %s is the output of shard %d, which is not in the plan." % (filename, shard_range["shard"]))
+
+        shard = plan["shards"][shard_range["shard"]]
+        if import_plan.getFirstList(shard_range) != import_plan.getFirstList(shard) \
+           or import_plan.getNextList(shard_range) != import_plan.getNextList(shard):
+            raise Exception("Error: The ranges of %s do not match shard %d of the plan." % (filename, shard_range["shard"]))
+
+        shard2filename[shard_range["shard"]] = filename
+
+    for shard in plan["shards"]:
+        if shard["shard"] not in shard2filename:
+            raise Exception("Error: The output of shard %d is missing." % shard["shard"])
+
+    for shard in plan["shards"]:
+        filename = shard2filename[shard["shard"]]
+        sys.stderr.write("Now reading: %s ...\n" % filename)
+        fin = open(filename, "rb")
+        shutil.copyfileobj(fin, fout)
         fin.close()